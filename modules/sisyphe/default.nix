@@ -22,6 +22,32 @@ let
     p.django-timezone-field
     django-celery-beat
   ]);
+  # Every node of a deployment must share the database, SQLite only suits a single host
+  databaseEnvironment = {
+    DB_ENGINE = cfg.dbEngine;
+    DB_NAME = "${cfg.djangoDbPath}";
+    DB_HOST = cfg.dbHost;
+    DB_PORT = optionalString (cfg.dbPort != null) (builtins.toString cfg.dbPort);
+    DB_USER = cfg.dbUser;
+    DB_PASSWORD = cfg.dbPassword;
+  };
+  workerEnvironment = databaseEnvironment // {
+    DEBUG = "${cfg.djangoDebug}";
+    SHELL = "bash";
+    DJANGO_HOST = "${cfg.host}";
+    DJANGO_SECRET_KEY = "${cfg.djangoSecretKey}";
+    AMQP_PASSWORD = "${cfg.rabbitmqPassword}";
+    AMQP_USER = "${cfg.rabbitmqUsername}";
+    AMQP_HOST = "${cfg.rabbitmqVhost}";
+    AMQP_AUTHORITY = "${cfg.rabbitmqHost}";
+    AMQP_PORT = "${builtins.toString cfg.rabbitmqPort}";
+    SISYPHE_ISO_PATH = "${vm.packages.x86_64-linux.iso.out}";
+    SISYPHE_WARM_POOL_SIZE = "${builtins.toString cfg.warmPoolSize}";
+    SISYPHE_INJECTION_BACKEND = "${cfg.injectionBackend}";
+    SISYPHE_VOLUME_RECLAIM = "${cfg.volumeReclaim}";
+    SISYPHE_PINNABLE_CPUS = cfg.pinnableCpus;
+    SISYPHE_HYPERVISOR_NAME = config.networking.hostName;
+  };
 in
 {
   options = {
@@ -79,11 +105,60 @@ in
       djangoDbPath = mkOption {
         type = types.str;
         default = "/data/sisyphe.db3";
+        description = "Path of the SQLite database, or name of the database with another engine.";
+      };
+      dbEngine = mkOption {
+        type = types.str;
+        default = "django.db.backends.sqlite3";
+        example = "django.db.backends.postgresql";
+        description = "Django database backend. Deployments with several nodes need a server all of them reach.";
+      };
+      dbHost = mkOption {
+        type = types.str;
+        default = "";
+      };
+      dbPort = mkOption {
+        type = types.nullOr types.port;
+        default = null;
+      };
+      dbUser = mkOption {
+        type = types.str;
+        default = "";
+      };
+      dbPassword = mkOption {
+        type = types.str;
+        default = "";
       };
       djangoDebug = mkOption {
         type = types.str;
         default = "False";
       };
+      warmPoolSize = mkOption {
+        type = types.int;
+        default = 0;
+        description = "Number of pre-warmed overlays kept ready for new runs.";
+      };
+      injectionBackend = mkOption {
+        type = types.enum [ "guestfish" "shared" "configdisk" ];
+        default = "guestfish";
+        description = "How the run secrets and SSH key reach the guest.";
+      };
+      volumeReclaim = mkOption {
+        type = types.enum [ "delete" "wipe" ];
+        default = "delete";
+        description = "How the volume of a finished run is reclaimed: deleted or wiped. Sensitive campaigns are always wiped.";
+      };
+      pinnableCpus = mkOption {
+        type = types.str;
+        default = "";
+        example = "4-15";
+        description = "Host CPUs reserved for the runs whose profile pins their vCPUs. Other domains, emulator and I/O threads use the remaining CPUs.";
+      };
+      scheduler = mkOption {
+        type = types.bool;
+        default = true;
+        description = "Run celery beat and the run timers on this node. Exactly one node of a deployment should.";
+      };
       enableTls = mkOption {
         type = types.bool;
         default = false;
@@ -116,31 +191,67 @@ in
       description = "The sisyphe celery server";
       wantedBy = [ "multi-user.target" ];
       after = [ "network.target" "rabbitmq.service" "sisyphe.service" ];
-      environment = {
-        DEBUG = "${cfg.djangoDebug}";
-        SHELL = "bash";
-        DB_NAME = "${cfg.djangoDbPath}";
-        DJANGO_HOST = "${cfg.host}";
-        DJANGO_SECRET_KEY = "${cfg.djangoSecretKey}";
-        AMQP_PASSWORD = "${cfg.rabbitmqPassword}";
-        AMQP_USER = "${cfg.rabbitmqUsername}";
-        AMQP_HOST = "${cfg.rabbitmqVhost}";
-        AMQP_AUTHORITY = "${cfg.rabbitmqHost}";
-        AMQP_PORT = "${builtins.toString cfg.rabbitmqPort}";
-        SISYPHE_ISO_PATH = "${vm.packages.x86_64-linux.iso.out}";
-      };
+      environment = workerEnvironment;
       serviceConfig = {
         ExecStart = pkgs.writeScript "celery" ''
           #!${pkgs.runtimeShell} -l
                     export PATH=''${PATH}:${pkgs.nix}/bin:${pkgs.git}/bin:${pkgs.gnutar}/bin:${pkgs.gzip}/bin:${pkgs.nix}/bin:${pkgs.nix}/bin
                     cd ${cfg.dataDir}/src
-                    ${pythonWithDjango}/bin/celery -A sisyphe worker -B
+                    ${pythonWithDjango}/bin/celery -A sisyphe worker ${optionalString cfg.scheduler "-B"}
         '';
         User = "sisyphe";
         Group = "sisyphe";
       };
     };
 
+    systemd.services.sisyphe-lifecycle = {
+      enable = true;
+      description = "Reclaims sisyphe runs as soon as their domain stops";
+      wantedBy = [ "multi-user.target" ];
+      after = [ "network.target" "libvirtd.service" "sisyphe.service" ];
+      environment = workerEnvironment;
+      serviceConfig = {
+        ExecStart = "${pythonWithDjango}/bin/python ${cfg.dataDir}/src/manage.py watch_lifecycle";
+        WorkingDirectory = "${cfg.dataDir}/src";
+        Restart = "always";
+        RestartSec = 5;
+        User = "sisyphe";
+        Group = "sisyphe";
+      };
+    };
+
+    systemd.services.sisyphe-timers = {
+      enable = cfg.scheduler;
+      description = "Fires the stop and cleanup deadlines of sisyphe runs";
+      wantedBy = [ "multi-user.target" ];
+      after = [ "network.target" "rabbitmq.service" "sisyphe.service" ];
+      environment = workerEnvironment;
+      serviceConfig = {
+        ExecStart = "${pythonWithDjango}/bin/python ${cfg.dataDir}/src/manage.py run_timers";
+        WorkingDirectory = "${cfg.dataDir}/src";
+        Restart = "always";
+        RestartSec = 5;
+        User = "sisyphe";
+        Group = "sisyphe";
+      };
+    };
+
+    systemd.services.sisyphe-sampler = {
+      enable = true;
+      description = "Samples the resources used by the domains of sisyphe runs";
+      wantedBy = [ "multi-user.target" ];
+      after = [ "network.target" "libvirtd.service" "sisyphe.service" ];
+      environment = workerEnvironment;
+      serviceConfig = {
+        ExecStart = "${pythonWithDjango}/bin/python ${cfg.dataDir}/src/manage.py sample_runs";
+        WorkingDirectory = "${cfg.dataDir}/src";
+        Restart = "always";
+        RestartSec = 5;
+        User = "sisyphe";
+        Group = "sisyphe";
+      };
+    };
+
     security.acme.email = "remy@grunblatt.org";
     security.acme.acceptTerms = true;
 
@@ -157,18 +268,20 @@ in
       recommendedProxySettings = true;
       recommendedTlsSettings = cfg.enableTls;
       appendHttpConfig = ''
-        proxy_cache_path /data/nginx/cache levels=1:2 keys_zone=sisyphe:720m inactive=24h max_size=1g;
+        proxy_cache_path /data/nginx/cache levels=1:2 keys_zone=sisyphe:720m inactive=1h max_size=1g;
       '';
       virtualHosts = {
         "${cfg.host}" = {
           enableACME = cfg.enableTls;
           forceSSL = cfg.enableTls;
-          locations."@sisyphe_cache" = {
+          # The HTML pages: Django invalidates its own copy as soon as a run changes, nginx follows
+          # their Cache-Control (max-age and stale-while-revalidate) and falls back to a minute
+          locations."~ ^/((campaign|run)/[0-9]+/)?$" = {
             proxyPass = "http://unix:/tmp/daphne.sock";
             extraConfig = ''
               add_header X-Cache $upstream_cache_status;
               proxy_cache sisyphe;
-              proxy_cache_valid 24h;
+              proxy_cache_valid 200 1m;
               proxy_cache_use_stale updating error timeout http_500 http_502 http_503 http_504;
               proxy_cache_background_update on;
               proxy_cache_key "$scheme://$host$request_method$request_uri";
@@ -188,9 +301,21 @@ in
               fancyindex_localtime on;
               fancyindex_exact_size off;
               fancyindex_name_length 255;
-              fancyindex_ignore "store";
+              fancyindex_ignore "store" ".sisyphe" ".blobs" ".manifests" ".mirrors";
+              # The guests write these directories, they may plant symlinks
+              disable_symlinks on;
             '';
           };
+          locations."/internal-artifacts/" = {
+            alias = "/home/sisyphe/";
+            extraConfig = ''
+              internal;
+              disable_symlinks on;
+            '';
+          };
+          locations."~ ^/artifacts/(\\.|[^/]+/\\.sisyphe)" = {
+            extraConfig = "deny all;";
+          };
         };
 
         "~^(?<subdomain>.+)\.${cfg.cacheHost}$" = {
@@ -217,8 +342,11 @@ in
     environment.systemPackages = [
       pkgs.qemu_full
       pkgs.libvirt
+      pkgs.passt
+      pkgs.virtiofsd
       pkgs.samba4Full
       pkgs.libguestfs-with-appliance
+      pkgs.cdrkit
     ];
 
     users.groups.sisyphe = { };
@@ -253,9 +381,8 @@ in
       wantedBy = [ "multi-user.target" ];
       before = [ "nginx.service" ];
       after = [ "network.target" ];
-      environment = {
+      environment = databaseEnvironment // {
         DEBUG = "${cfg.djangoDebug}";
-        DB_NAME = "${cfg.djangoDbPath}";
         DJANGO_HOST = "${cfg.host}";
         DJANGO_SECRET_KEY = "${cfg.djangoSecretKey}";
         AMQP_PASSWORD = "${cfg.rabbitmqPassword}";
@@ -264,10 +391,14 @@ in
         AMQP_AUTHORITY = "${cfg.rabbitmqHost}";
         AMQP_PORT = "${builtins.toString cfg.rabbitmqPort}";
         SISYPHE_ISO_PATH = "${vm.packages.x86_64-linux.iso.out}";
+        SISYPHE_ACCEL_REDIRECT_PREFIX = "/internal-artifacts/";
       };
       script = ''
         cd ${cfg.dataDir}/src &&
         ${pythonWithDjango}/bin/python manage.py migrate --noinput &&
+        ${pythonWithDjango}/bin/python manage.py createcachetable &&
+        # Pages rendered by the previous templates
+        ${pythonWithDjango}/bin/python manage.py shell -c 'from django.core.cache import cache; cache.clear()' &&
         ${pythonWithDjango}/bin/python manage.py collectstatic --noinput &&
         ${pythonWithDjango}/bin/daphne -u /tmp/daphne.sock sisyphe.asgi:application
       '';
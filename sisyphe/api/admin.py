@@ -1,6 +1,16 @@
 from django.contrib import admin
-from .models import Campaign, Run, EnvironmentVariable
+from .models import Campaign, Run, EnvironmentVariable, WarmVolume, QueuedRun, PortLease, Timer, Blob, SampleChunk, ResourceProfile, CpuPin, BackingImage, Hypervisor
 
 admin.site.register(Campaign)
 admin.site.register(Run)
-admin.site.register(EnvironmentVariable)
\ No newline at end of file
+admin.site.register(EnvironmentVariable)
+admin.site.register(WarmVolume)
+admin.site.register(QueuedRun)
+admin.site.register(PortLease)
+admin.site.register(Timer)
+admin.site.register(Blob)
+admin.site.register(SampleChunk)
+admin.site.register(ResourceProfile)
+admin.site.register(CpuPin)
+admin.site.register(BackingImage)
+admin.site.register(Hypervisor)
@@ -0,0 +1,180 @@
+import datetime, hashlib, json, uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import cpus, models, nodes
+
+
+def jitter(campaign_id, slot):
+    # Same campaign and slot, same offset: a burst of schedules is spread the same way every time
+    window = settings.SISYPHE_DISPATCH_WINDOW
+    if not window:
+        return datetime.timedelta()
+    digest = hashlib.sha1(f"{campaign_id}:{slot.isoformat()}".encode()).digest()
+    return datetime.timedelta(seconds=int.from_bytes(digest[:4], 'big') % window)
+
+
+def enqueue(campaign, scheduled=None):
+    # Beat fires on minute boundaries, which is the slot of the run
+    slot = scheduled or timezone.now().replace(second=0, microsecond=0)
+    return models.QueuedRun.objects.create(
+        campaign=campaign,
+        priority=campaign.priority,
+        scheduled=slot,
+        not_before=slot + jitter(campaign.pk, slot),
+    )
+
+
+class NodeState:
+    # Capacity of a node as of its last heartbeat, minus what admission hands out meanwhile
+    def __init__(self, node, used_memory, used_vcpus, pending_memory, provisioning, used_cpus):
+        reserved_memory = settings.SISYPHE_HOST_RESERVED_MEMORY
+        self.node = node
+        self.memory_limit = node.total_memory * settings.SISYPHE_MEMORY_OVERCOMMIT - reserved_memory
+        self.vcpu_limit = node.cpus * settings.SISYPHE_CPU_OVERCOMMIT
+        # Runs admitted since the heartbeat do not show in its free memory yet
+        self.free_memory = node.free_memory - reserved_memory - pending_memory
+        self.used_memory = used_memory
+        self.used_vcpus = used_vcpus
+        # Guestfish appliances, overlays and cold boots are what hurts the disk, not running domains
+        self.slots = settings.SISYPHE_PROVISIONING_CONCURRENCY - provisioning
+        self.cores = [cpus.Core(numa, cores) for numa, cores in json.loads(node.cores)]
+        self.used_cpus = used_cpus
+
+    def pinned(self, campaign):
+        return campaign.profile is not None and campaign.profile.pin_vcpus
+
+    def could_fit(self, campaign):
+        if campaign.memory > self.memory_limit or campaign.vcpus > self.vcpu_limit:
+            return False
+        return not self.pinned(campaign) or cpus.pick(self.cores, set(), campaign.vcpus, campaign.profile.numa_node) is not None
+
+    def fit(self, campaign):
+        # The cores to pin when it fits now (None when unpinned), False otherwise
+        if self.slots <= 0 or campaign.memory > self.free_memory:
+            return False
+        if self.used_memory + campaign.memory > self.memory_limit or self.used_vcpus + campaign.vcpus > self.vcpu_limit:
+            return False
+        if not self.pinned(campaign):
+            return None
+        return cpus.pick(self.cores, self.used_cpus, campaign.vcpus, campaign.profile.numa_node) or False
+
+    def take(self, campaign, picked):
+        self.used_memory += campaign.memory
+        self.used_vcpus += campaign.vcpus
+        self.free_memory -= campaign.memory
+        self.slots -= 1
+        if picked:
+            self.used_cpus.update(cpu for core in picked for cpu in core.cpus)
+
+    def load(self):
+        return self.used_memory / max(self.memory_limit, 1) + self.used_vcpus / max(self.vcpu_limit, 1)
+
+
+def node_states(active):
+    states = []
+    for node in nodes.live():
+        runs = active.filter(hypervisor=node)
+        usage = runs.aggregate(memory=Sum('memory'), vcpus=Sum('vcpus'))
+        pending = runs.filter(Q(provisioned__isnull=True) | Q(provisioned__gte=node.heartbeat)).aggregate(memory=Sum('memory'))
+        states.append(NodeState(
+            node,
+            usage['memory'] or 0,
+            usage['vcpus'] or 0,
+            pending['memory'] or 0,
+            runs.filter(provisioned__isnull=True).count(),
+            cpus.used_cpus(node),
+        ))
+    return states
+
+
+def last_nodes(campaign_ids):
+    # Node of the latest run of each campaign
+    latest = models.Run.objects.filter(campaign_id__in=campaign_ids).values('campaign').annotate(last=Max('pk')).values_list('last', flat=True)
+    return dict(models.Run.objects.filter(pk__in=list(latest)).values_list('campaign_id', 'hypervisor_id'))
+
+
+def place(states, campaign, previous):
+    # Least loaded node among the ones that fit, the node of the previous run of the campaign on a tie
+    candidates = [state for state in states if campaign.hypervisor_id in (None, state.node.pk)]
+    fitting = []
+    for state in candidates:
+        picked = state.fit(campaign)
+        if picked is not False:
+            fitting.append((state.load(), state.node.pk != previous, state.node.name, state, picked))
+    if not fitting:
+        return candidates, None, None
+    _, _, _, state, picked = min(fitting, key=lambda candidate: candidate[:3])
+    return candidates, state, picked
+
+
+def admit():
+    admitted = []
+    with transaction.atomic():
+        # The queue is locked before the capacity is read: a concurrent admission waits here,
+        # then sees the runs this one created instead of handing out the same room twice
+        queue = list(
+            models.QueuedRun.objects.select_for_update().select_related('campaign__profile')
+            .filter(Q(not_before__isnull=True) | Q(not_before__lte=timezone.now()))
+        )
+        active = models.Run.objects.filter(end__isnull=True)
+        active_runs = dict(active.order_by().values_list('campaign').annotate(Count('id')))
+        states = node_states(active)
+
+        previous = last_nodes({queued.campaign_id for queued in queue})
+        while queue:
+            # Highest priority first, then the campaign with the fewest active runs, then FIFO
+            head = min(queue, key=lambda queued: (-queued.priority, active_runs.get(queued.campaign_id, 0), queued.enqueued))
+            queue.remove(head)
+            campaign = head.campaign
+            candidates, state, picked = place(states, campaign, previous.get(campaign.id))
+            if state is None:
+                if not candidates and campaign.hypervisor_id is not None:
+                    # Its pinned node is down, the other campaigns can still go ahead
+                    print(f"Campaign {campaign.name} waits for its node to come back")
+                    continue
+                if candidates and not any(candidate.could_fit(campaign) for candidate in candidates):
+                    # Waiting will not change that, its runs leave the queue instead of being skipped every pass
+                    dropped = [head] + [queued for queued in queue if queued.campaign_id == campaign.id]
+                    queue = [queued for queued in queue if queued.campaign_id != campaign.id]
+                    models.QueuedRun.objects.filter(pk__in=[queued.pk for queued in dropped]).delete()
+                    print(
+                        f"Dropped {len(dropped)} queued runs of {campaign.name}: {campaign.memory} MiB and "
+                        f"{campaign.vcpus} vCPUs is more than its nodes can ever offer"
+                    )
+                    continue
+                break
+
+            run = models.Run.objects.create(
+                campaign=campaign,
+                uuid=str(uuid.uuid4()),
+                memory=campaign.memory,
+                vcpus=campaign.vcpus,
+                enqueued=head.enqueued,
+                scheduled=head.scheduled,
+                hypervisor=state.node,
+            )
+            if picked:
+                cpus.assign(run, picked)
+            admitted.append(run)
+            head.delete()
+            state.take(campaign, picked)
+            previous[campaign.id] = state.node.pk
+            active_runs[campaign.id] = active_runs.get(campaign.id, 0) + 1
+    return admitted
+
+
+def queue_stats(campaign, sample=50):
+    queued = models.QueuedRun.objects.filter(campaign=campaign)
+    oldest = queued.order_by('enqueued').values_list('enqueued', flat=True).first()
+    # Only the latest runs are looked at, whether they went through the queue or not
+    latest = models.Run.objects.filter(campaign=campaign).order_by('-pk').values_list('start', 'enqueued')[:sample]
+    waits = [start - enqueued for start, enqueued in latest if enqueued is not None]
+    return {
+        'depth': queued.count(),
+        'oldest': oldest,
+        'wait': sum(waits, datetime.timedelta()) / len(waits) if waits else None,
+    }
@@ -0,0 +1,173 @@
+import hashlib, os, stat, tarfile, time, zipfile
+
+from django.conf import settings
+
+from .manifest import EXCLUDED
+
+CHUNK_SIZE = 64 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def run_directory(uuid):
+    return os.path.join(settings.SISYPHE_ARTIFACTS_ROOT, uuid)
+
+
+def resolve(root, path):
+    # The path relative to the run once the symlinks the guest may have planted are
+    # resolved, None when it leaves the run or reaches its secrets
+    parts = [part for part in path.split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or parts[0] in EXCLUDED:
+        return None
+    real_root = os.path.realpath(root)
+    relative = os.path.relpath(os.path.realpath(os.path.join(real_root, *parts)), real_root)
+    components = relative.split(os.sep)
+    if relative == os.curdir or components[0] == os.pardir or EXCLUDED & set(components):
+        return None
+    return relative
+
+
+def open_file(root, relative):
+    # Opens root/relative one component at a time, never following a symlink: whatever
+    # the guest swaps in after resolve, the file opened is inside the run
+    fd = os.open(os.path.realpath(root), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        *directories, name = relative.split(os.sep)
+        for directory in directories:
+            child = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd)
+            os.close(fd)
+            fd = child
+        return os.open(name, os.O_RDONLY | os.O_NOFOLLOW, dir_fd=fd)
+    finally:
+        os.close(fd)
+
+
+def manifest_etag(manifest):
+    digest = hashlib.sha1()
+    for entry in manifest:
+        digest.update(repr(tuple(entry)).encode())
+    return digest.hexdigest()
+
+
+class TarLayout:
+    # The byte layout of an uncompressed tar of the manifest, known before a single
+    # byte is read, which is what makes ranges and resumed downloads possible
+    def __init__(self, root, manifest):
+        self.root = root
+        self.segments = []
+        self.offsets = {}
+        self.size = 0
+        for entry in manifest:
+            info = tarfile.TarInfo(entry.path)
+            info.mtime = entry.mtime
+            info.mode = entry.mode
+            if entry.link is not None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = entry.link
+            else:
+                info.size = entry.size
+            self.add(info.tobuf(format=tarfile.GNU_FORMAT))
+            if entry.link is None:
+                self.offsets[entry.path] = self.size
+                self.add((entry.path, entry.size))
+                self.add(b'\0' * (-entry.size % BLOCK_SIZE))
+        self.add(b'\0' * (2 * BLOCK_SIZE))
+
+    def add(self, segment):
+        length = len(segment) if isinstance(segment, bytes) else segment[1]
+        if length:
+            self.segments.append((self.size, length, segment))
+            self.size += length
+
+    def stream(self, start=0, end=None):
+        end = self.size if end is None else end
+        for offset, length, segment in self.segments:
+            if offset + length <= start:
+                continue
+            if offset >= end:
+                break
+            skip = max(start - offset, 0)
+            take = min(offset + length, end) - offset - skip
+            if isinstance(segment, bytes):
+                yield segment[skip:skip + take]
+            else:
+                yield from read_file(self.root, segment[0], skip, take)
+
+
+def read_file(root, relative, start, length):
+    # The files of a live run may change under us: a symlink where the manifest saw a file
+    # reads as zeros, like a file which shrank, which keeps the layout intact
+    relative = resolve(root, relative)
+    try:
+        f = os.fdopen(open_file(root, relative), 'rb') if relative is not None else None
+    except OSError:
+        f = None
+    if f is not None and not stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        f.close()
+        f = None
+    try:
+        if f is not None:
+            f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length)) if f is not None else b''
+            if not chunk:
+                chunk = b'\0' * min(CHUNK_SIZE, length)
+            length -= len(chunk)
+            yield chunk
+    finally:
+        if f is not None:
+            f.close()
+
+
+class _Sink:
+    # Write-only file object: zipfile falls back to data descriptors when it cannot seek
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_zip(root, manifest):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for entry in manifest:
+            if entry.link is not None:
+                continue
+            info = zipfile.ZipInfo(entry.path, date_time=zip_date(entry.mtime))
+            info.external_attr = (stat.S_IFREG | entry.mode) << 16
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for chunk in read_file(root, entry.path, 0, entry.size):
+                    member.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def zip_date(mtime):
+    return max(time.gmtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def parse_range(header, size):
+    # Only single ranges are supported: "bytes=start-end", "bytes=start-" or "bytes=-suffix"
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if first == '':
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= end:
+        raise ValueError(f"Unsatisfiable range {header}")
+    return start, end
@@ -0,0 +1,65 @@
+import functools, hashlib, uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+
+from . import models
+
+
+def generation(name, pk=None):
+    # Part of every page key: replacing it orphans all the pages of the object, whatever their query string
+    return cache.get_or_set(f"generation:{name}:{pk}", lambda: uuid.uuid4().hex, None)
+
+
+def invalidate(name, pk=None):
+    cache.set(f"generation:{name}:{pk}", uuid.uuid4().hex, None)
+
+
+def invalidate_campaign(campaign_id):
+    invalidate('campaign', campaign_id)
+    # The index lists campaigns, the runs API names them
+    invalidate('index')
+    invalidate('runs')
+
+
+def invalidate_runs(pks):
+    # For the queryset updates, which send no signal
+    for pk, campaign_id in models.Run.objects.filter(pk__in=pks).values_list('pk', 'campaign_id'):
+        invalidate('run', pk)
+        invalidate('campaign', campaign_id)
+    invalidate('runs')
+
+
+def public(response):
+    # Shared caches may serve a page a little longer while they fetch a fresh one
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=settings.SISYPHE_PAGE_MAX_AGE,
+        stale_while_revalidate=settings.SISYPHE_PAGE_STALE_WHILE_REVALIDATE,
+    )
+    return response
+
+
+def cached_page(name, argument=None):
+    # Caches the rendered page of the object the view argument designates, until it changes
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            pk = kwargs.get(argument) if argument else None
+            path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+            key = f"page:{name}:{pk}:{generation(name, pk)}:{path}"
+            content = cache.get(key)
+            if content is not None:
+                return public(HttpResponse(content))
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.content, settings.SISYPHE_PAGE_CACHE_TIMEOUT)
+                public(response)
+            return response
+        return wrapper
+    return decorator
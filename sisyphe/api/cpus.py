@@ -0,0 +1,78 @@
+import xml.etree.ElementTree as ET
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+
+from . import models
+
+# cpus holds the hyperthreads of the core, the first one runs the vCPU
+Core = namedtuple('Core', ['node', 'cpus'])
+
+
+def parse_cpu_list(value):
+    # "2-7,10,12-13" -> [2, 3, 4, 5, 6, 7, 10, 12, 13]
+    cpus = []
+    for part in filter(None, value.split(',')):
+        first, _, last = part.partition('-')
+        cpus += range(int(first), int(last or first) + 1)
+    return cpus
+
+
+def format_cpu_list(cpus):
+    return ','.join(str(cpu) for cpu in sorted(cpus))
+
+
+def topology(connection):
+    # Physical cores of the host from the libvirt capabilities, restricted to the pinnable CPUs
+    pinnable = set(parse_cpu_list(settings.SISYPHE_PINNABLE_CPUS))
+    cores = defaultdict(list)
+    capabilities = ET.fromstring(connection.getCapabilities())
+    for cell in capabilities.iterfind('host/topology/cells/cell'):
+        node = int(cell.get('id'))
+        for cpu in cell.iterfind('cpus/cpu'):
+            cores[node, cpu.get('socket_id'), cpu.get('core_id')].append(int(cpu.get('id')))
+    # A core is only handed out when all of its threads are pinnable
+    return [
+        Core(node, sorted(cpus)) for (node, _, _), cpus in sorted(cores.items(), key=lambda item: min(item[1]))
+        if set(cpus) <= pinnable
+    ]
+
+
+def used_cpus(hypervisor):
+    return set(models.CpuPin.objects.filter(hypervisor=hypervisor).values_list('cpu', flat=True))
+
+
+def pick(cores, used, count, node=None):
+    # Best fit: the node with the fewest free cores that still fits the run
+    free = defaultdict(list)
+    for core in cores:
+        if not used.intersection(core.cpus) and node in (None, core.node):
+            free[core.node].append(core)
+    candidates = [available for available in free.values() if len(available) >= count]
+    if not candidates:
+        return None
+    return min(candidates, key=len)[:count]
+
+
+def assign(run, picked):
+    models.CpuPin.objects.bulk_create([
+        models.CpuPin(cpu=cpu, run=run, hypervisor_id=run.hypervisor_id, node=core.node, vcpu=vcpu if i == 0 else None)
+        for vcpu, core in enumerate(picked)
+        for i, cpu in enumerate(core.cpus)
+    ])
+
+
+def pins(run_id):
+    # vcpu -> host CPU, and the NUMA node of the cores
+    rows = list(models.CpuPin.objects.filter(run_id=run_id, vcpu__isnull=False).values_list('vcpu', 'cpu', 'node'))
+    return {vcpu: cpu for vcpu, cpu, _ in rows}, (rows[0][2] if rows else None)
+
+
+def shared_cpus(total):
+    # Unpinned domains, emulator threads and I/O threads stay off the pinnable CPUs
+    pinnable = set(parse_cpu_list(settings.SISYPHE_PINNABLE_CPUS))
+    return [cpu for cpu in range(total) if cpu not in pinnable]
+
+
+def release(run_id):
+    models.CpuPin.objects.filter(run_id=run_id).delete()
@@ -0,0 +1,114 @@
+import fcntl, os, shutil
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from . import artifacts, caching, manifest, models, nodes
+
+FICLONE = 0x40049409
+
+
+def blob_path(key):
+    return os.path.join(settings.SISYPHE_BLOB_ROOT, key[:2], key)
+
+
+def reflink(source, destination):
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def share(source, destination):
+    if settings.SISYPHE_DEDUP_MODE == 'reflink':
+        reflink(source, destination)
+    else:
+        os.link(source, destination)
+
+
+def deduplicate(run):
+    root = artifacts.run_directory(run.uuid)
+    # The manifest already carries the digest of every file
+    entries = manifest.load(run.uuid) or manifest.update(run)
+
+    saved = 0
+    digests = {}
+    for entry in entries:
+        if entry.link is not None or entry.size < settings.SISYPHE_DEDUP_MIN_SIZE:
+            continue
+        # The permissions are part of the key, every link of a blob shares them
+        key = f"{entry.digest}-{entry.mode:o}"
+        path = os.path.join(root, entry.path)
+        claim(run, key, entry.size)
+        try:
+            saved += store(path, blob_path(key))
+            digests[entry.path] = entry.digest
+        except OSError as e:
+            # Typically read-only directories copied from the Nix store
+            print(f"Could not deduplicate {path}: {e}")
+
+    # Linked files now carry the mtime of their blob, their content did not change
+    manifest.update(run, known=digests)
+    models.Run.objects.filter(pk=run.pk).update(dedup_saved=F('dedup_saved') + saved)
+    caching.invalidate_runs([run.pk])
+    return saved
+
+
+def claim(run, key, size):
+    # The row lock orders this against collect(): either the blob survives with the run
+    # referring to it, or collect() removed it first and it is created again
+    with transaction.atomic():
+        blob, _ = models.Blob.objects.select_for_update().get_or_create(hypervisor=nodes.local(), key=key, defaults={'size': size})
+        blob.runs.add(run)
+    return blob
+
+
+def store(path, target):
+    # Returns the number of bytes given back to the filesystem
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        if os.path.samefile(path, target):
+            return 0
+    except FileNotFoundError:
+        try:
+            share(path, target)
+            return 0
+        except FileExistsError:
+            pass
+
+    temporary = f"{path}.dedup"
+    share(target, temporary)
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        os.remove(temporary)
+        raise
+    return os.path.getsize(path)
+
+
+def unreferenced():
+    return models.Blob.objects.filter(hypervisor=nodes.local()).annotate(references=Count('runs')).filter(references=0)
+
+
+def collect():
+    # Blobs no remaining run refers to
+    removed = 0
+    for pk in list(unreferenced().values_list('pk', flat=True)):
+        with transaction.atomic():
+            # A run may have claimed it since the listing
+            blob = models.Blob.objects.select_for_update().filter(pk=pk).first()
+            if blob is None or blob.runs.exists():
+                continue
+            try:
+                os.remove(blob_path(blob.key))
+                removed += blob.size
+            except FileNotFoundError:
+                pass
+            blob.delete()
+    return removed
+
+
+def remove_run_directory(uuid):
+    def report(function, path, excinfo):
+        if not isinstance(excinfo[1], FileNotFoundError):
+            print(f"Could not remove {path}: {excinfo[1]}")
+    shutil.rmtree(artifacts.run_directory(uuid), onerror=report)
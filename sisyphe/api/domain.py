@@ -0,0 +1,143 @@
+from django.conf import settings
+
+from . import cpus
+
+
+def cputune(pins, shared, iothreads):
+    if not pins:
+        return ''
+    lines = [f"<vcpupin vcpu='{vcpu}' cpuset='{cpu}'/>" for vcpu, cpu in sorted(pins.items())]
+    if shared:
+        lines.append(f"<emulatorpin cpuset='{cpus.format_cpu_list(shared)}'/>")
+        lines += [f"<iothreadpin iothread='{i}' cpuset='{cpus.format_cpu_list(shared)}'/>" for i in range(1, iothreads + 1)]
+    return f"<cputune>{''.join(lines)}</cputune>"
+
+
+def uses_virtio(profile):
+    return profile is not None and profile.devices == 'virtio'
+
+
+def memory_backing(profile):
+    elements = []
+    if profile is not None and profile.hugepages:
+        elements.append('<hugepages/>')
+    if uses_virtio(profile):
+        # virtiofsd maps the guest memory, which has to be shared
+        elements.append("<source type='memfd'/><access mode='shared'/>")
+    return f"<memoryBacking>{''.join(elements)}</memoryBacking>" if elements else ''
+
+
+def numatune(node):
+    if node is None:
+        return ''
+    return f"<numatune><memory mode='strict' nodeset='{node}'/></numatune>"
+
+
+def disk_driver(profile):
+    attributes = "name='qemu' type='qcow2'"
+    if profile is not None:
+        if profile.disk_cache:
+            attributes += f" cache='{profile.disk_cache}'"
+        if profile.disk_io:
+            attributes += f" io='{profile.disk_io}'"
+        if profile.iothreads:
+            attributes += " iothread='1'"
+    return f"<driver {attributes} />"
+
+
+def shared_directory(worker, profile):
+    if uses_virtio(profile):
+        return f'''
+                            <filesystem type='mount' accessmode='passthrough'>
+                                    <driver type='virtiofs' queue='1024'/>
+                                    <binary path='/run/current-system/sw/bin/virtiofsd'/>
+                                    <source dir='{worker.dirname}'/>
+                                    <target dir='srv'/>
+                                    <alias name='fs0'/>
+                            </filesystem>'''
+    return f'''
+                            <filesystem type='mount' accessmode='squash'>
+                                    <source dir='{worker.dirname}'/>
+                                    <target dir='srv'/>
+                                    <alias name='fs0'/>
+                                    <address type='pci' domain='0x0000' bus='0x01' slot='0x00' function='0x0'/>
+                            </filesystem>'''
+
+
+def network(worker, profile):
+    if uses_virtio(profile):
+        # passt: unprivileged user networking with a virtio-net device and the SSH port forwarded
+        return f'''
+                            <interface type='user'>
+                                    <backend type='passt'/>
+                                    <portForward proto='tcp'>
+                                            <range start='{worker.ssh_port}' to='22'/>
+                                    </portForward>
+                                    <model type='virtio'/>
+                            </interface>''', ''
+    return '', f'''
+                    <qemu:commandline>
+                            <qemu:arg value='-netdev'/>
+                            <qemu:arg value='user,id=mynet.0,net=10.0.10.0/24,hostfwd=tcp::{worker.ssh_port}-:22'/>
+                            <qemu:arg value='-device'/>
+                            <qemu:arg value='e1000,netdev=mynet.0'/>
+                    </qemu:commandline>'''
+
+
+def build(worker, profile=None, pins=None, node=None, shared=None):
+    # pins maps the vCPUs to dedicated host CPUs, shared lists the CPUs left to everything else
+    pins = pins or {}
+    iothreads = profile.iothreads if profile is not None else 0
+    if profile is not None and profile.numa_node is not None:
+        node = profile.numa_node
+    cpuset = f" cpuset='{cpus.format_cpu_list(shared)}'" if shared and not pins else ''
+    interface, commandline = network(worker, profile)
+    return f'''
+            <domain type='{settings.SISYPHE_DOMAIN_TYPE}' id='2' xmlns:qemu='http://libvirt.org/schemas/domain/qemu/1.0'>
+                    <name>{worker.uuid}</name>
+                    <memory unit='MiB'>{worker.run.memory}</memory>
+                    {memory_backing(profile)}
+                    <vcpu placement='static'{cpuset}>{worker.run.vcpus}</vcpu>
+                    {f"<iothreads>{iothreads}</iothreads>" if iothreads else ''}
+                    {cputune(pins, shared, iothreads)}
+                    {numatune(node)}
+                    <os>
+                            <type arch='x86_64' machine='pc-q35-6.0'>hvm</type>
+                            <boot dev='hd'/>
+                    </os>
+                    <features>
+                            <acpi/>
+                            <apic/>
+                    </features>
+                    <devices>
+                            <emulator>/run/current-system/sw/bin/qemu-system-x86_64</emulator>
+                            <disk type="volume" device="disk">
+                                    {disk_driver(profile)}
+                                    <source type="volume" pool="{worker.pool_name}" volume="{worker.volume_name}" />
+                                    <backingStore type='file'>
+                                        <source file='{worker.backing_image_path}'/>
+                                        <format type='qcow2'/>
+                                    </backingStore>
+                                    <target dev="vda" bus="virtio"/>
+                                    <alias name='virtio-disk0'/>
+                                    <address type='pci' domain='0x0000' bus='0x04' slot='0x00' function='0x0'/>
+                            </disk>
+                            {shared_directory(worker, profile)}
+                            {interface}
+                            <serial type='pty'>
+                                    <source path='/dev/pts/3'/>
+                                    <target type='isa-serial' port='0'>
+                                            <model name='isa-serial'/>
+                                    </target>
+                                    <alias name='serial0'/>
+                            </serial>
+                            <console type='pty' tty='/dev/pts/3'>
+                                    <source path='/dev/pts/3'/>
+                                    <target type='serial' port='0'/>
+                                    <alias name='serial0'/>
+                            </console>
+                            {''.join(worker.extra_devices)}
+                    </devices>
+                    {commandline}
+            </domain>
+        '''
@@ -0,0 +1,59 @@
+#!/bin/sh
+# Disk and network throughput as seen from inside a run, to compare the device profiles.
+# Run it from a campaign: sh io_benchmark.sh <download url> [size in MiB]
+# The download should weigh a few hundred MiB, a small file only measures the latency.
+# One JSON object per measure is appended to /srv/io_benchmark.jsonl, so it ends up in the artifacts.
+set -eu
+
+if [ $# -lt 1 ]; then
+    echo "usage: $0 <download url> [size in MiB]" >&2
+    exit 1
+fi
+URL="$1"
+SIZE="${2:-1024}"
+OUT=/srv/io_benchmark.jsonl
+FSTYPE="$(awk '$2 == "/srv" { print $3 }' /proc/mounts)"
+
+now() {
+    date +%s.%N
+}
+
+record() {
+    # name, bytes, start, end
+    awk -v name="$1" -v bytes="$2" -v start="$3" -v end="$4" -v fstype="$FSTYPE" 'BEGIN {
+        seconds = end - start
+        printf "{\"measure\": \"%s\", \"bytes\": %d, \"seconds\": %.3f, \"mib_per_s\": %.1f, \"srv_fstype\": \"%s\"}\n", name, bytes, seconds, bytes / 1048576 / seconds, fstype
+    }' >> "$OUT"
+}
+
+dd_write() {
+    # name, file
+    start="$(now)"
+    dd if=/dev/zero of="$2" bs=1M count="$SIZE" conv=fsync 2>/dev/null
+    record "$1" $((SIZE * 1048576)) "$start" "$(now)"
+}
+
+dd_read() {
+    sync
+    echo 3 > /proc/sys/vm/drop_caches
+    start="$(now)"
+    dd if="$2" of=/dev/null bs=1M 2>/dev/null
+    record "$1" $((SIZE * 1048576)) "$start" "$(now)"
+}
+
+# Root disk: virtio-blk on the qcow2 overlay
+dd_write disk_write /var/tmp/io_benchmark
+dd_read disk_read /var/tmp/io_benchmark
+rm -f /var/tmp/io_benchmark
+
+# Shared directory: 9p or virtiofs
+dd_write srv_write /srv/io_benchmark.tmp
+dd_read srv_read /srv/io_benchmark.tmp
+rm -f /srv/io_benchmark.tmp
+
+# Network: e1000 user networking or virtio-net through passt
+start="$(now)"
+bytes="$(curl -sSL -o /dev/null -w '%{size_download}' "$URL")"
+record download "$bytes" "$start" "$(now)"
+
+cat "$OUT"
@@ -0,0 +1,153 @@
+import threading, time
+from collections import OrderedDict
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+import libvirt
+
+POOL_NAME = "sisyphe-disks"
+POOL_PATH = "/var/tmp"
+DOMAIN_CACHE_SIZE = 256
+
+# One connection per worker process, shared by every task it runs
+_lock = threading.RLock()
+_connection = None
+_pools = {}
+_domains = OrderedDict()
+
+
+def get_connection():
+    global _connection
+    with _lock:
+        if _connection is not None:
+            try:
+                if _connection.isAlive():
+                    return _connection
+            except libvirt.libvirtError:
+                pass
+            print("The connection to the hypervisor was lost, reconnecting")
+            _reset()
+
+        delay = settings.SISYPHE_LIBVIRT_RECONNECT_DELAY
+        attempts = settings.SISYPHE_LIBVIRT_RECONNECT_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                _connection = libvirt.open(settings.SISYPHE_LIBVIRT_URI)
+                return _connection
+            except libvirt.libvirtError:
+                if attempt == attempts:
+                    print('Failed to open connection to the hypervisor')
+                    raise
+                print(f'Failed to open connection to the hypervisor, retrying in {delay}s')
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+
+def close_connection(**kwargs):
+    with _lock:
+        if _connection is not None:
+            try:
+                _connection.close()
+            except libvirt.libvirtError:
+                pass
+        _reset()
+
+
+def _reset():
+    global _connection
+    _connection = None
+    _pools.clear()
+    _domains.clear()
+
+
+worker_process_shutdown.connect(close_connection)
+worker_shutdown.connect(close_connection)
+
+
+def get_pool(pool_name=POOL_NAME, pool_path=POOL_PATH):
+    connection = get_connection()
+    with _lock:
+        pool = _pools.get(pool_name)
+        if pool is None:
+            pool = _pools[pool_name] = ensure_pool(connection, pool_name, pool_path)
+        return pool
+
+
+def ensure_pool(connection, pool_name=POOL_NAME, pool_path=POOL_PATH):
+    try:
+        pool = connection.storagePoolLookupByName(pool_name)
+    except libvirt.libvirtError:
+        print("The pool does not exist")
+        poolXML = f'''
+        <pool type='dir'>
+          <name>{pool_name}</name>
+          <uuid/>
+          <source>
+          </source>
+          <target>
+            <path>{pool_path}</path>
+            <permissions>
+              <mode>0755</mode>
+              <owner>-1</owner>
+              <group>-1</group>
+            </permissions>
+          </target>
+        </pool>
+        '''
+        pool = connection.storagePoolDefineXML(poolXML, 0)
+        pool.setAutostart(1)
+        pool.create()
+    if not pool.isActive():
+        pool.create()
+    return pool
+
+
+def remember_domain(name, domain):
+    with _lock:
+        _domains[name] = domain
+        _domains.move_to_end(name)
+        while len(_domains) > DOMAIN_CACHE_SIZE:
+            _domains.popitem(last=False)
+
+
+def forget_domain(name):
+    with _lock:
+        _domains.pop(name, None)
+
+
+def lookup_domain(name):
+    # Returns None once the (transient) domain is gone. A cached handle may outlive
+    # its domain: act on it through with_domain, which looks it up again
+    connection = get_connection()
+    with _lock:
+        domain = _domains.get(name)
+    if domain is not None:
+        return domain
+    try:
+        domain = connection.lookupByName(name)
+    except libvirt.libvirtError as e:
+        if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+            return None
+        raise
+    remember_domain(name, domain)
+    return domain
+
+
+def with_domain(name, action, default=None):
+    # The result of action on the domain, default once it is gone
+    for _ in range(2):
+        domain = lookup_domain(name)
+        if domain is None:
+            return default
+        try:
+            return action(domain)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            # Stale cached handle, the second lookup asks libvirt
+            forget_domain(name)
+    return default
+
+
+def is_domain_active(name):
+    return bool(with_domain(name, lambda domain: domain.isActive(), False))
@@ -0,0 +1,88 @@
+import fcntl, os, subprocess, time
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import models, nodes
+from .hypervisor import POOL_PATH
+from .manifest import hash_file
+
+
+def source_path():
+    return os.environ["SISYPHE_ISO_PATH"] + "/nixos.qcow2"
+
+
+def convert(source, target):
+    command = ['qemu-img', 'convert', '-O', 'qcow2']
+    if settings.SISYPHE_BACKING_IMAGE_COMPRESS:
+        command.append('-c')
+    if settings.SISYPHE_BACKING_IMAGE_PREALLOCATION:
+        command += ['-o', f"preallocation={settings.SISYPHE_BACKING_IMAGE_PREALLOCATION}"]
+    subprocess.run(command + [source, target], check=True)
+    # Verified once here, never again
+    subprocess.run(['qemu-img', 'check', '-q', target], check=True)
+    os.chmod(target, 0o444)
+
+
+def stage(source):
+    # Copies the image next to the overlays, once per store path and content
+    image = models.BackingImage.objects.filter(hypervisor=nodes.local(), source=source).first()
+    if image is not None and os.path.exists(image.path):
+        return image
+    with open(os.path.join(POOL_PATH, '.backing.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        image = models.BackingImage.objects.filter(hypervisor=nodes.local(), source=source).first()
+        if image is not None and os.path.exists(image.path):
+            return image
+
+        started = time.monotonic()
+        digest = hash_file(source)
+        path = os.path.join(POOL_PATH, f"backing_{digest[:16]}.qcow2")
+        # Another store path may hold the very same image
+        if not os.path.exists(path):
+            convert(source, f"{path}.tmp")
+            os.rename(f"{path}.tmp", path)
+        image, _ = models.BackingImage.objects.update_or_create(hypervisor=nodes.local(), source=source, defaults={
+            'digest': digest,
+            'path': path,
+            'size': os.path.getsize(path),
+            'verified': timezone.now(),
+        })
+        print(f"Staged {source} as {path} in {time.monotonic() - started:.1f}s")
+        prefetch(path)
+        return image
+
+
+def current():
+    # The image the stageImage task staged for the source, the source itself until it is ready
+    source = source_path()
+    image = models.BackingImage.objects.filter(hypervisor=nodes.local(), source=source).first()
+    if image is not None and os.path.exists(image.path):
+        return image.path
+    return source
+
+
+def prefetch(path):
+    # Asks the kernel to read the whole image into the page cache, without waiting for it
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def collect(referenced):
+    # Older generations, once no overlay is built on them anymore
+    keep = source_path()
+    removed = []
+    for image in models.BackingImage.objects.filter(hypervisor=nodes.local()).exclude(source=keep):
+        if image.path in referenced:
+            continue
+        if not models.BackingImage.objects.filter(hypervisor=nodes.local(), path=image.path).exclude(pk=image.pk).exists():
+            try:
+                os.remove(image.path)
+            except FileNotFoundError:
+                pass
+        image.delete()
+        removed.append(image.path)
+    return removed
@@ -0,0 +1,95 @@
+import os, shutil, subprocess, tempfile
+
+from django.conf import settings
+
+SECRETS_DIRECTORY = ".sisyphe"
+CONFIG_DISK_LABEL = "SISYPHE"
+
+
+def config_disk_path(pool_path, uuid):
+    return os.path.join(pool_path, f"config_{uuid}.iso")
+
+
+class GuestfishInjector:
+    # Boots a libguestfs appliance to write straight into the overlay
+    name = "guestfish"
+
+    def inject(self, worker, secrets):
+        tmp_env = tempfile.NamedTemporaryFile(mode='w+t')
+        guestfish_commands = tempfile.NamedTemporaryFile(mode='w+t')
+        tmp_env.write(secrets)
+        tmp_env.file.flush()
+
+        guestfish_commands.write(
+                f'add {os.path.join(worker.pool_path, worker.volume_name)}\n'
+                f'run\n'
+                f'mount /dev/sda1 /\n'
+                f'upload {tmp_env.name} /etc/sisyphe_secrets\n'
+                f'mkdir /root/.ssh/\n'
+                f'write /root/.ssh/authorized_keys "{worker.public_key}"\n'
+                f'quit'
+        )
+        guestfish_commands.file.flush()
+
+        # A failed upload must not boot a guest without its secrets
+        subprocess.run(["guestfish", "--file", guestfish_commands.name], env=worker.environment, check=True)
+        return []
+
+
+class SharedDirectoryInjector:
+    # The run directory is already exported to the guest as srv
+    name = "shared"
+
+    def inject(self, worker, secrets):
+        path = os.path.join(worker.dirname, SECRETS_DIRECTORY)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        write_secrets(path, secrets, worker.public_key)
+        return []
+
+
+class ConfigDiskInjector:
+    # A small read-only ISO attached as a cdrom, labelled SISYPHE
+    name = "configdisk"
+
+    def inject(self, worker, secrets):
+        iso = config_disk_path(worker.pool_path, worker.uuid)
+        with tempfile.TemporaryDirectory() as staging:
+            write_secrets(staging, secrets, worker.public_key)
+            subprocess.run(["genisoimage", "-quiet", "-output", iso, "-volid", CONFIG_DISK_LABEL, "-joliet", "-rock", staging], check=True)
+        os.chmod(iso, 0o600)
+        return [f'''
+                            <disk type='file' device='cdrom'>
+                                    <driver name='qemu' type='raw'/>
+                                    <source file='{iso}'/>
+                                    <target dev='sda' bus='sata'/>
+                                    <readonly/>
+                            </disk>
+        ''']
+
+
+INJECTORS = {injector.name: injector for injector in (GuestfishInjector, SharedDirectoryInjector, ConfigDiskInjector)}
+
+
+def write_secrets(path, secrets, public_key):
+    for name, content in (("sisyphe_secrets", secrets), ("authorized_keys", public_key)):
+        fd = os.open(os.path.join(path, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+
+
+def get_injector(name=None):
+    name = name or settings.SISYPHE_INJECTION_BACKEND
+    try:
+        return INJECTORS[name]()
+    except KeyError:
+        print(f"Unknown injection backend {name}, falling back to guestfish")
+        return GuestfishInjector()
+
+
+def cleanup(pool_path, uuid, dirname):
+    # Whatever backend was used, no secret should outlive the domain
+    shutil.rmtree(os.path.join(dirname, SECRETS_DIRECTORY), ignore_errors=True)
+    try:
+        os.remove(config_disk_path(pool_path, uuid))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,71 @@
+import os, queue, threading
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519
+from cryptography.hazmat.backends import default_backend
+from django.conf import settings
+
+
+def serialize(key, private_format):
+    pub_key = key.public_key().public_bytes(serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH)
+    pem = key.private_bytes(encoding=serialization.Encoding.PEM, format=private_format, encryption_algorithm=serialization.NoEncryption())
+    return pem.decode('utf-8'), pub_key.decode('utf-8')
+
+
+class RSAKeyProvider:
+    name = "rsa"
+
+    def generate(self):
+        key = rsa.generate_private_key(backend=default_backend(), public_exponent=65537, key_size=2048)
+        return serialize(key, serialization.PrivateFormat.TraditionalOpenSSL)
+
+
+class Ed25519KeyProvider:
+    name = "ed25519"
+
+    def generate(self):
+        # Ed25519 keys only have an OpenSSH private format
+        return serialize(ed25519.Ed25519PrivateKey.generate(), serialization.PrivateFormat.OpenSSH)
+
+
+class PooledKeyProvider:
+    # One-time keypairs generated ahead of time by a background thread, each handed out once
+    def __init__(self, provider, size):
+        self.provider = provider
+        self.name = f"pooled-{provider.name}"
+        self.size = size
+        self.pid = None
+
+    def ensure_started(self):
+        # Threads do not survive the fork of the Celery pool processes
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.keys = queue.Queue(maxsize=self.size)
+        threading.Thread(target=self.fill, daemon=True).start()
+
+    def fill(self):
+        while True:
+            self.keys.put(self.provider.generate())
+
+    def generate(self):
+        self.ensure_started()
+        try:
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return self.provider.generate()
+
+
+PROVIDERS = {provider.name: provider for provider in (RSAKeyProvider, Ed25519KeyProvider)}
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        provider = PROVIDERS[settings.SISYPHE_SSH_KEY_TYPE]()
+        if settings.SISYPHE_SSH_KEY_POOL_SIZE:
+            provider = PooledKeyProvider(provider, settings.SISYPHE_SSH_KEY_POOL_SIZE)
+        _provider = provider
+    return _provider
@@ -0,0 +1,51 @@
+import statistics, time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from api.models import Campaign, Run
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway database with runs and time the campaign page at several depths"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Time the rendering itself, and keep away from the cache of the deployment
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                self.bench(options['runs'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def bench(self, count, repeat):
+        campaign = Campaign.objects.create(name="bench", source="https://example.org/bench.git")
+        client = Client()
+        url = reverse('campaign_detail', kwargs={'campaign_id': campaign.pk})
+        seeded = 0
+        for target in sorted({1000, 10000, count}):
+            if target > count:
+                continue
+            # One hidden run out of ten, as left behind by unfinished runs
+            Run.objects.bulk_create(
+                [Run(campaign=campaign, uuid=f"bench-{i}", hidden=(i % 10 == 0)) for i in range(seeded, target)],
+                batch_size=5000,
+            )
+            seeded = target
+            ids = list(Run.objects.filter(campaign=campaign, hidden=False).order_by('-start', '-id').values_list('pk', flat=True))
+            for label, query in (("first page", ""), ("middle page", f"?before={ids[len(ids) // 2]}"), ("last page", f"?before={ids[-10]}")):
+                timings = []
+                for _ in range(repeat):
+                    started = time.monotonic()
+                    response = client.get(url + query)
+                    timings.append(time.monotonic() - started)
+                assert response.status_code == 200
+                self.stdout.write(f"{seeded:>8} runs, {label:>11}: median {statistics.median(timings) * 1000:.2f} ms")
@@ -0,0 +1,47 @@
+import os, statistics, subprocess, tempfile, time, types, uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import injection
+
+
+class Command(BaseCommand):
+    help = "Compare the wall time of the secret injection backends on a scratch overlay"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', default=None, help="Backing image (defaults to SISYPHE_ISO_PATH/nixos.qcow2)")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--backend', action='append', choices=sorted(injection.INJECTORS), help="Backend to measure, may be repeated (defaults to all)")
+
+    def handle(self, *args, **options):
+        image = options['image'] or os.path.join(os.environ.get('SISYPHE_ISO_PATH', ''), 'nixos.qcow2')
+        if not os.path.exists(image):
+            raise CommandError(f"Backing image {image} does not exist")
+        backends = options['backend'] or sorted(injection.INJECTORS)
+        public_key = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIBenchmarkBenchmarkBenchmarkBenchmarkBenchm bench"
+        secrets = f'REPOSITORY="https://example.org/bench.git"\nSSH_PUBLIC_KEY="{public_key}"\n'
+
+        for name in backends:
+            timings = []
+            for _ in range(options['repeat']):
+                with tempfile.TemporaryDirectory() as scratch:
+                    run_uuid = str(uuid.uuid4())
+                    worker = types.SimpleNamespace(
+                        uuid=run_uuid,
+                        pool_path=scratch,
+                        volume_name=f"volume_{run_uuid}_nixos.qcow2",
+                        dirname=os.path.join(scratch, run_uuid),
+                        environment=os.environ.copy(),
+                        public_key=public_key,
+                    )
+                    os.makedirs(worker.dirname)
+                    subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2", "-F", "qcow2", "-b", image, os.path.join(scratch, worker.volume_name)], check=True)
+
+                    started = time.monotonic()
+                    injection.INJECTORS[name]().inject(worker, secrets)
+                    timings.append(time.monotonic() - started)
+
+            self.stdout.write(
+                f"{name:>12}: mean {statistics.mean(timings):.3f}s "
+                f"min {min(timings):.3f}s max {max(timings):.3f}s over {len(timings)} runs"
+            )
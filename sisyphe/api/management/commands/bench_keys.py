@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import keys
+
+
+class Command(BaseCommand):
+    help = "Measure how many SSH keypairs per second each key provider hands out"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help="Keypairs requested from each provider")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        for name, cls in sorted(keys.PROVIDERS.items()):
+            self.report(cls(), count)
+
+            pooled = keys.PooledKeyProvider(cls(), count)
+            pooled.ensure_started()
+            while not pooled.keys.full():
+                time.sleep(0.01)
+            self.report(pooled, count)
+
+    def report(self, provider, count):
+        started = time.monotonic()
+        for _ in range(count):
+            provider.generate()
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{provider.name:>16}: {count / elapsed:10.1f} keys/s ({elapsed / count * 1000:.3f} ms per key)")
@@ -0,0 +1,211 @@
+import json, math, os, statistics, tempfile, threading, time
+
+from celery.contrib.testing.worker import start_worker
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+
+from sisyphe.celery import app
+from api import models, nodes, timers, tracing
+from api.tasks import cleanupCampaign, runCampaign, stopCampaign
+
+# Sleeps instead of booting a libguestfs appliance
+GUESTFISH = "#!/bin/sh\nsleep {delay}\n"
+# convert creates its (last) target argument, check and everything else succeed
+QEMU_IMG = "#!/bin/sh\nif [ \"$1\" = convert ]; then for last; do :; done; : > \"$last\"; fi\n"
+
+
+def percentile(values, q):
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def summary(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': statistics.mean(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def install_stub(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
+
+class Command(BaseCommand):
+    help = "Drive runCampaign, stopCampaign and cleanupCampaign through a throwaway database, an in-memory broker and libvirt's test driver"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, action='append', help="Provisioning concurrency to measure, may be repeated (defaults to 1, 2, 4 and 8)")
+        parser.add_argument('--runs', type=int, default=20, help="Runs submitted at once for each concurrency level")
+        parser.add_argument('--guestfish-delay', type=float, default=0.5, help="Seconds the stub guestfish sleeps")
+        parser.add_argument('--memory', type=int, default=256, help="MiB per run")
+        parser.add_argument('--uri', default='test:///default')
+        parser.add_argument('--timeout', type=float, default=600.0, help="Seconds to wait for the runs of one level")
+        parser.add_argument('--output', default='bench_provisioning.json')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as scratch:
+            # A file rather than memory, the worker threads each open their own connection
+            connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, 'bench.db3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.bench(scratch, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def bench(self, scratch, options):
+        bin_directory = os.path.join(scratch, 'bin')
+        os.makedirs(bin_directory)
+        install_stub(bin_directory, 'guestfish', GUESTFISH.format(delay=options['guestfish_delay']))
+        install_stub(bin_directory, 'qemu-img', QEMU_IMG)
+        with open(os.path.join(scratch, 'nixos.qcow2'), 'wb') as f:
+            f.write(os.urandom(1024 * 1024))
+        environment = {name: os.environ.get(name) for name in ('PATH', 'SISYPHE_ISO_PATH')}
+        os.environ['PATH'] = f"{bin_directory}:{os.environ['PATH']}"
+        os.environ['SISYPHE_ISO_PATH'] = scratch
+        app.conf.broker_url = 'memory://'
+        # The default second between two polls would dominate every hop
+        app.conf.broker_transport_options = {'polling_interval': 0.01}
+
+        levels = []
+        staged = []
+        try:
+            with override_settings(
+                SISYPHE_LIBVIRT_URI=options['uri'],
+                SISYPHE_DOMAIN_TYPE='test' if options['uri'].startswith('test:') else 'kvm',
+                SISYPHE_INJECTION_BACKEND='guestfish',
+                SISYPHE_ARTIFACTS_ROOT=os.path.join(scratch, 'artifacts'),
+                SISYPHE_BLOB_ROOT=os.path.join(scratch, 'blobs'),
+                SISYPHE_MANIFEST_ROOT=os.path.join(scratch, 'manifests'),
+                SISYPHE_MIRROR_ROOT='',
+                SISYPHE_WARM_POOL_SIZE=0,
+                SISYPHE_DISPATCH_WINDOW=0,
+                SISYPHE_SHUTDOWN_DEADLINE=0,
+                SISYPHE_HEARTBEAT_TIMEOUT=24 * 3600,
+                # The invalidations of the runs must not reach the cache of the deployment
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            ):
+                os.makedirs(os.path.join(scratch, 'artifacts'))
+                # The test driver reports a toy host, the node offers room for every run at once
+                models.Hypervisor.objects.update_or_create(name=nodes.local().name, defaults={
+                    'total_memory': 1024 * 1024,
+                    'free_memory': 1024 * 1024,
+                    'cpus': 4096,
+                    'cores': '[]',
+                    'heartbeat': timezone.now(),
+                })
+                for concurrency in sorted(set(options['concurrency'] or [1, 2, 4, 8])):
+                    with override_settings(SISYPHE_PROVISIONING_CONCURRENCY=concurrency):
+                        levels.append(self.level(concurrency, options))
+                staged = list(models.BackingImage.objects.values_list('path', flat=True))
+        finally:
+            for name, value in environment.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        # The stub image was staged next to the overlays
+        for path in staged:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        result = {
+            'date': timezone.now().isoformat(),
+            'uri': options['uri'],
+            'runs': options['runs'],
+            'guestfish_delay': options['guestfish_delay'],
+            'memory': options['memory'],
+            'levels': levels,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(result, f, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+    def level(self, concurrency, options):
+        campaign = models.Campaign.objects.create(
+            name=f"bench-{concurrency}",
+            source="https://example.org/bench.git",
+            duration=0,
+            memory=options['memory'],
+            vcpus=1,
+        )
+        dispatcher = timers.Dispatcher({'stop': stopCampaign, 'cleanup': cleanupCampaign}, refresh=0.05)
+        stopped = threading.Event()
+
+        def fire_timers():
+            while not stopped.is_set():
+                dispatcher.load()
+                dispatcher.fire_due()
+                time.sleep(0.05)
+
+        # Room for the admission and timer tasks next to the provisionings
+        with start_worker(app, concurrency=concurrency + 2, pool='threads', perform_ping_check=False, queues=['celery', nodes.local_queue()]):
+            timer_thread = threading.Thread(target=fire_timers, daemon=True)
+            timer_thread.start()
+            started = time.monotonic()
+            for _ in range(options['runs']):
+                runCampaign.delay(campaign.pk)
+            runs = models.Run.objects.filter(campaign=campaign)
+            while time.monotonic() - started < options['timeout']:
+                if runs.filter(end__isnull=False).count() >= options['runs']:
+                    break
+                time.sleep(0.2)
+            elapsed = time.monotonic() - started
+            stopped.set()
+            timer_thread.join()
+
+        phases = {}
+        completed = 0
+        failed = 0
+        for run in runs:
+            if run.reclaimed is None:
+                # Failed provisionings end without being reclaimed
+                failed += run.end is not None
+                continue
+            completed += 1
+            for name, begin, end in (
+                ('admission', run.enqueued, run.start),
+                ('provisioning', run.start, run.provisioned),
+                ('stop', run.provisioned, run.stop_requested),
+                ('cleanup', run.stop_requested, run.reclaimed),
+                ('total', run.enqueued, run.reclaimed),
+            ):
+                if begin is not None and end is not None:
+                    phases.setdefault(name, []).append((end - begin).total_seconds())
+        informations = models.RunInformation.objects.filter(campaign__in=runs, key__startswith=tracing.KEY_PREFIX)
+        for key, value in informations.values_list('key', 'value'):
+            name = key[len(tracing.KEY_PREFIX):]
+            try:
+                phases.setdefault(f"provisioning.{name}", []).append(float(value))
+            except ValueError:
+                pass
+
+        level = {
+            'concurrency': concurrency,
+            'submitted': options['runs'],
+            'completed': completed,
+            'failed': failed,
+            'elapsed': elapsed,
+            'runs_per_minute': completed / elapsed * 60,
+            'phases': {name: summary(values) for name, values in sorted(phases.items())},
+        }
+        self.stdout.write(f"concurrency {concurrency:>3}: {completed}/{options['runs']} runs ({failed} failed) in {elapsed:.1f}s, {level['runs_per_minute']:.1f} runs/min")
+        for name, stats in level['phases'].items():
+            if stats['count']:
+                self.stdout.write(
+                    f"    {name:>28}: p50 {stats['p50'] * 1000:9.1f} ms  p95 {stats['p95'] * 1000:9.1f} ms  p99 {stats['p99'] * 1000:9.1f} ms"
+                )
+        return level
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api import reconcile
+from api.tasks import reconcileRuns
+
+
+class Command(BaseCommand):
+    help = "Repair the runs whose domain, volume, directory, port lease or timers went out of sync"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be fixed")
+        parser.add_argument('--verbose-fixes', action='store_true', help="List every object of every fix")
+
+    def handle(self, *args, **options):
+        fixes = reconcileRuns(dry_run=options['dry_run'])
+        if options['verbose_fixes']:
+            for name in reconcile.FIXES:
+                for item in fixes[name]:
+                    self.stdout.write(f"{name}: {getattr(item, 'uuid', item)}")
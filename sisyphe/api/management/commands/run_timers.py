@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.timers import Dispatcher
+from api.tasks import stopCampaign, cleanupCampaign
+
+
+class Command(BaseCommand):
+    help = "Fire the stop and cleanup timers of the runs when they are due"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', type=float, default=5.0, help="Seconds between two reloads of the timer table")
+        parser.add_argument('--horizon', type=float, default=60.0, help="Only timers due within this many seconds are kept in memory")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Dispatching run timers")
+        Dispatcher(
+            {'stop': stopCampaign, 'cleanup': cleanupCampaign},
+            refresh=options['refresh'],
+            horizon=options['horizon'],
+        ).run_forever()
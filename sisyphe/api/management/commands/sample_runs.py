@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+import libvirt
+
+from api import hypervisor, models, sampling
+from api.reconcile import UUID_PATTERN
+
+STATS = (
+    libvirt.VIR_DOMAIN_STATS_CPU_TOTAL | libvirt.VIR_DOMAIN_STATS_BALLOON
+    | libvirt.VIR_DOMAIN_STATS_BLOCK | libvirt.VIR_DOMAIN_STATS_INTERFACE
+)
+
+
+def total(stats, kind, field):
+    return sum(stats.get(f"{kind}.{i}.{field}", 0) for i in range(stats.get(f"{kind}.count", 0)))
+
+
+def extract(stats):
+    # Same order as sampling.COLUMNS, after the time
+    return (
+        stats.get('cpu.time', 0),
+        stats.get('balloon.current', 0),
+        stats.get('balloon.rss', 0),
+        total(stats, 'block', 'rd.bytes'),
+        total(stats, 'block', 'wr.bytes'),
+        total(stats, 'net', 'rx.bytes'),
+        total(stats, 'net', 'tx.bytes'),
+    )
+
+
+class Command(BaseCommand):
+    help = "Sample the resources used by the domains of the runs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=10.0, help="Seconds between two samples")
+        parser.add_argument('--chunk-size', type=int, default=60, help="Samples buffered per run before being written")
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        # run uuid -> (start of the chunk, rows)
+        self.buffers = {}
+        self.runs = {}
+        self.stdout.write(f"Sampling the domains every {options['interval']}s")
+        while True:
+            started = time.monotonic()
+            close_old_connections()
+            try:
+                self.sample(hypervisor.get_connection())
+            except libvirt.libvirtError as e:
+                self.stdout.write(f"Sampling failed: {e}")
+                hypervisor.close_connection()
+            time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
+
+    def sample(self, connection):
+        now = timezone.now()
+        # A single call for every domain, whatever their number
+        stats = connection.getAllDomainStats(STATS, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+        seen = set()
+        for domain, values in stats:
+            name = domain.name()
+            if not UUID_PATTERN.match(name):
+                continue
+            seen.add(name)
+            start, rows = self.buffers.setdefault(name, (now, []))
+            rows.append(((now - start).total_seconds(),) + extract(values))
+
+        missing = seen - self.runs.keys()
+        if missing:
+            self.runs.update(models.Run.objects.filter(uuid__in=missing).values_list('uuid', 'pk'))
+        # Full buffers, and the ones of the domains which went away
+        self.flush([name for name, (_, rows) in self.buffers.items() if name not in seen or len(rows) >= self.chunk_size])
+        for name in self.runs.keys() - seen:
+            del self.runs[name]
+
+    def flush(self, names):
+        chunks = []
+        for name in names:
+            start, rows = self.buffers.pop(name)
+            run_id = self.runs.get(name)
+            if run_id is not None:
+                chunks.append(models.SampleChunk(run_id=run_id, start=start, count=len(rows), data=sampling.pack(zip(*rows))))
+        models.SampleChunk.objects.bulk_create(chunks)
@@ -0,0 +1,56 @@
+import queue, threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import libvirt
+
+from api import hypervisor, models, nodes
+from api.tasks import reclaim
+
+
+class Command(BaseCommand):
+    help = "Reclaim the resources of a run as soon as its domain stops"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sweep-interval', type=float, default=60.0, help="Seconds between two checks of the connection and of missed events")
+
+    def handle(self, *args, **options):
+        # The event loop has to be registered before the connection is opened
+        libvirt.virEventRegisterDefaultImpl()
+        threading.Thread(target=self.run_event_loop, daemon=True).start()
+
+        self.stopped = queue.Queue()
+        connection = None
+        while True:
+            if connection is None or not connection.isAlive():
+                hypervisor.close_connection()
+                connection = hypervisor.get_connection()
+                connection.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self.on_lifecycle, None)
+                self.stdout.write("Watching domain lifecycle events")
+                self.sweep()
+
+            try:
+                name = self.stopped.get(timeout=options['sweep_interval'])
+            except queue.Empty:
+                self.sweep()
+                continue
+            close_old_connections()
+            run = models.Run.objects.filter(uuid=name, reclaimed__isnull=True).first()
+            if run is not None and reclaim(run.pk, run.uuid):
+                self.stdout.write(f"Reclaimed run {run.uuid}")
+
+    def run_event_loop(self):
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    def on_lifecycle(self, connection, domain, event, detail, opaque):
+        # Runs on the event loop thread: hand the domain over and return quickly
+        if event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+            self.stopped.put(domain.name())
+
+    def sweep(self):
+        # Domains which stopped while nobody was listening
+        close_old_connections()
+        for run in nodes.owned(models.Run.objects.filter(stop_requested__isnull=False, reclaimed__isnull=True)):
+            if not hypervisor.is_domain_active(run.uuid) and reclaim(run.pk, run.uuid):
+                self.stdout.write(f"Reclaimed run {run.uuid}")
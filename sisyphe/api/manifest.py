@@ -0,0 +1,110 @@
+import hashlib, json, os, stat
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import caching, models
+
+# Never listed nor served: the injected secrets of the run
+EXCLUDED = {'.sisyphe'}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+Entry = namedtuple('Entry', ['path', 'size', 'mtime', 'mode', 'link', 'digest'], defaults=[None])
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path(uuid):
+    return os.path.join(settings.SISYPHE_MANIFEST_ROOT, f"{uuid}.jsonl")
+
+
+def scan_directory(root, relative):
+    entries, directories = [], []
+    with os.scandir(os.path.join(root, relative)) as it:
+        for item in it:
+            path = f"{relative}/{item.name}" if relative else item.name
+            if not relative and item.name in EXCLUDED:
+                continue
+            info = item.stat(follow_symlinks=False)
+            if item.is_symlink():
+                entries.append(Entry(path, 0, int(info.st_mtime), stat.S_IMODE(info.st_mode), os.readlink(item.path)))
+            elif item.is_dir(follow_symlinks=False):
+                directories.append(path)
+            elif item.is_file(follow_symlinks=False):
+                entries.append(Entry(path, info.st_size, int(info.st_mtime), stat.S_IMODE(info.st_mode), None))
+    return entries, directories
+
+
+def scan(root, workers=1):
+    # Breadth first, every directory of a level is listed in parallel
+    entries, level = [], ['']
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            next_level = []
+            for found, directories in pool.map(lambda relative: scan_directory(root, relative), level):
+                entries += found
+                next_level += directories
+            level = next_level
+    entries.sort()
+    return entries
+
+
+def load(uuid):
+    try:
+        with open(manifest_path(uuid)) as f:
+            return [Entry(**json.loads(line)) for line in f]
+    except FileNotFoundError:
+        return None
+
+
+def save(uuid, entries):
+    path = manifest_path(uuid)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry._asdict(), separators=(',', ':')) + '\n')
+    os.replace(f"{path}.tmp", path)
+
+
+def update(run, known=None):
+    # Only files whose size or mtime changed since the last manifest are hashed again
+    root = os.path.join(settings.SISYPHE_ARTIFACTS_ROOT, run.uuid)
+    known = dict(known or {})
+    for entry in load(run.uuid) or []:
+        known.setdefault(entry.path, entry)
+
+    def refresh(entry):
+        if entry.link is not None:
+            return entry
+        previous = known.get(entry.path)
+        if isinstance(previous, str):
+            return entry._replace(digest=previous)
+        if previous is not None and previous.digest and (previous.size, previous.mtime) == (entry.size, entry.mtime):
+            return entry._replace(digest=previous.digest)
+        return entry._replace(digest=hash_file(os.path.join(root, entry.path)))
+
+    workers = settings.SISYPHE_MANIFEST_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = list(pool.map(refresh, scan(root, workers)))
+    save(run.uuid, entries)
+    models.Run.objects.filter(pk=run.pk).update(
+        file_count=sum(1 for entry in entries if entry.link is None),
+        total_bytes=sum(entry.size for entry in entries),
+    )
+    caching.invalidate_runs([run.pk])
+    return entries
+
+
+def get(run):
+    # The stored manifest once the run is over, a live scan while it still writes
+    entries = load(run.uuid) if run.reclaimed else None
+    if entries is None:
+        entries = scan(os.path.join(settings.SISYPHE_ARTIFACTS_ROOT, run.uuid))
+    return entries
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_delete_process'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarmVolume',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.CharField(max_length=100, unique=True)),
+                ('backing_image', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RunInformation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.TextField()),
+                ('value', models.TextField()),
+                ('campaign', models.ManyToManyField(to='api.Run')),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_runinformation_warmvolume'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='memory',
+            field=models.IntegerField(default=2048),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='vcpus',
+            field=models.IntegerField(default=2),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='enqueued',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='memory',
+            field=models.IntegerField(default=2048),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='vcpus',
+            field=models.IntegerField(default=2),
+        ),
+        migrations.CreateModel(
+            name='QueuedRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.IntegerField(default=0)),
+                ('enqueued', models.DateTimeField(auto_now_add=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.campaign')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_admission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('port', models.IntegerField(unique=True)),
+                ('expires', models.DateTimeField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.run')),
+            ],
+        ),
+    ]
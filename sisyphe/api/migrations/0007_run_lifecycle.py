@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_portlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='reclaimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='stop_requested',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
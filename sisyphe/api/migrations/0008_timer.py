@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_run_lifecycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Timer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('stop', 'Stop the domain'), ('cleanup', 'Enforce the shutdown deadline')], max_length=16)),
+                ('due', models.DateTimeField(db_index=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.run')),
+            ],
+            options={
+                'unique_together': {('run', 'action')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:22
+
+import uuid
+
+from django.db import migrations, models
+
+
+def deduplicate_uuids(apps, schema_editor):
+    # Runs created before 0002 share the empty default uuid
+    Run = apps.get_model('api', 'Run')
+    seen = set()
+    for run in Run.objects.order_by('pk').only('pk', 'uuid'):
+        if run.uuid and run.uuid not in seen:
+            seen.add(run.uuid)
+            continue
+        run.uuid = str(uuid.uuid4())
+        run.save(update_fields=['uuid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_timer'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_uuids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='run',
+            name='uuid',
+            field=models.CharField(default='', max_length=100, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['campaign', 'hidden', 'start'], name='api_run_campaig_56717d_idx'),
+        ),
+    ]
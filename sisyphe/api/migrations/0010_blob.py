@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_run_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='dedup_saved',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('runs', models.ManyToManyField(to='api.Run')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='file_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='total_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
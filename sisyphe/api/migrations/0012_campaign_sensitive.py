@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_run_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='sensitive',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_campaign_sensitive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SampleChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField()),
+                ('level', models.SmallIntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.run')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='samplechunk',
+            index=models.Index(fields=['run', 'start'], name='api_samplec_run_id_368d60_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='samplechunk',
+            index=models.Index(fields=['level', 'start'], name='api_samplec_level_ae0711_idx'),
+        ),
+    ]
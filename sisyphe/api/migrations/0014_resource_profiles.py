@@ -0,0 +1,42 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_samplechunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('pin_vcpus', models.BooleanField(default=False)),
+                ('hugepages', models.BooleanField(default=False)),
+                ('numa_node', models.IntegerField(blank=True, null=True)),
+                ('disk_cache', models.CharField(blank=True, choices=[('', 'Hypervisor default'), ('none', 'none'), ('writethrough', 'writethrough'), ('writeback', 'writeback'), ('directsync', 'directsync'), ('unsafe', 'unsafe')], default='', max_length=16)),
+                ('disk_io', models.CharField(blank=True, choices=[('', 'Hypervisor default'), ('threads', 'threads'), ('native', 'native'), ('io_uring', 'io_uring')], default='', max_length=16)),
+                ('iothreads', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CpuPin',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cpu', models.IntegerField(unique=True)),
+                ('vcpu', models.IntegerField(blank=True, null=True)),
+                ('node', models.IntegerField(default=0)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.run')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='profile',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.resourceprofile'),
+        ),
+    ]
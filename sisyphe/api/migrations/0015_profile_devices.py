@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_resource_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourceprofile',
+            name='devices',
+            field=models.CharField(choices=[('legacy', 'e1000 user networking and 9p /srv'), ('virtio', 'virtio-net through passt and virtiofs /srv')], default='legacy', max_length=16),
+        ),
+    ]
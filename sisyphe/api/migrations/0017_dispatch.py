@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:36
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_provisioned(apps, schema_editor):
+    # Runs created before the provisioning limit must not hold a provisioning slot
+    Run = apps.get_model('api', 'Run')
+    Run.objects.update(provisioned=F('start'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_backingimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedrun',
+            name='not_before',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='queuedrun',
+            name='scheduled',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='provisioned',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='scheduled',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_provisioned, migrations.RunPython.noop),
+    ]
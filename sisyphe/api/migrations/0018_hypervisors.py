@@ -0,0 +1,111 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_local(apps, schema_editor):
+    # Everything so far ran on the single host doing the migration
+    Hypervisor = apps.get_model('api', 'Hypervisor')
+    names = ['Run', 'WarmVolume', 'PortLease', 'Blob', 'CpuPin', 'BackingImage']
+    if not any(apps.get_model('api', name).objects.exists() for name in names):
+        return
+    node, _ = Hypervisor.objects.get_or_create(name=settings.SISYPHE_HYPERVISOR_NAME)
+    for name in names:
+        apps.get_model('api', name).objects.update(hypervisor=node)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_dispatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hypervisor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('total_memory', models.IntegerField(default=0)),
+                ('free_memory', models.IntegerField(default=0)),
+                ('cpus', models.IntegerField(default=0)),
+                ('cores', models.TextField(default='[]')),
+                ('heartbeat', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='backingimage',
+            name='source',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='blob',
+            name='key',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='cpupin',
+            name='cpu',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='portlease',
+            name='port',
+            field=models.IntegerField(),
+        ),
+        migrations.AddField(
+            model_name='backingimage',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.hypervisor'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.hypervisor'),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.hypervisor'),
+        ),
+        migrations.AddField(
+            model_name='cpupin',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.hypervisor'),
+        ),
+        migrations.AddField(
+            model_name='portlease',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.hypervisor'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.hypervisor'),
+        ),
+        migrations.AddField(
+            model_name='warmvolume',
+            name='hypervisor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.hypervisor'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='backingimage',
+            unique_together={('hypervisor', 'source')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='blob',
+            unique_together={('hypervisor', 'key')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='cpupin',
+            unique_together={('hypervisor', 'cpu')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='portlease',
+            unique_together={('hypervisor', 'port')},
+        ),
+        migrations.RunPython(assign_local, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_hypervisors'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='backingimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('hypervisor__isnull', True)), fields=('source',), name='backingimage_source_without_hypervisor'),
+        ),
+        migrations.AddConstraint(
+            model_name='blob',
+            constraint=models.UniqueConstraint(condition=models.Q(('hypervisor__isnull', True)), fields=('key',), name='blob_key_without_hypervisor'),
+        ),
+        migrations.AddConstraint(
+            model_name='cpupin',
+            constraint=models.UniqueConstraint(condition=models.Q(('hypervisor__isnull', True)), fields=('cpu',), name='cpupin_cpu_without_hypervisor'),
+        ),
+        migrations.AddConstraint(
+            model_name='portlease',
+            constraint=models.UniqueConstraint(condition=models.Q(('hypervisor__isnull', True)), fields=('port',), name='portlease_port_without_hypervisor'),
+        ),
+    ]
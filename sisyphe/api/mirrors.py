@@ -0,0 +1,63 @@
+import fcntl, hashlib, os, shutil, subprocess, threading
+
+from django.conf import settings
+
+from .injection import SECRETS_DIRECTORY
+
+# Mirror statistics of the current worker process
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+
+def mirror_path(source):
+    return os.path.join(settings.SISYPHE_MIRROR_ROOT, f"{hashlib.sha1(source.encode()).hexdigest()[:16]}.git")
+
+
+def objects_size(path):
+    size = 0
+    for directory, _, files in os.walk(os.path.join(path, 'objects')):
+        size += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    return size
+
+
+def git(*args, cwd=None):
+    subprocess.run(['git', *args], cwd=cwd, check=True, timeout=settings.SISYPHE_MIRROR_TIMEOUT,
+                   stdout=subprocess.DEVNULL, env={**os.environ, 'GIT_TERMINAL_PROMPT': '0'})
+
+
+def refresh(source):
+    # Returns whether the mirror already existed and the bytes fetched to bring it up to date
+    path = mirror_path(source)
+    os.makedirs(settings.SISYPHE_MIRROR_ROOT, exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock:
+        # Runs of the same campaign started together wait for a single fetch
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isdir(path):
+            before = objects_size(path)
+            git('remote', 'update', '--prune', cwd=path)
+            return True, max(0, objects_size(path) - before)
+        shutil.rmtree(f"{path}.tmp", ignore_errors=True)
+        git('clone', '--mirror', '--quiet', source, f"{path}.tmp")
+        os.rename(f"{path}.tmp", path)
+        return False, objects_size(path)
+
+
+def checkout(source, dirname):
+    # A private clone in the secrets directory of the run: refs and config are its own, the immutable
+    # object files are hardlinked from the mirror (git copies them when the run is on another filesystem)
+    hit, fetched = refresh(source)
+    secrets = os.path.join(dirname, SECRETS_DIRECTORY)
+    os.makedirs(secrets, mode=0o700, exist_ok=True)
+    target = os.path.join(secrets, 'source.git')
+    git('clone', '--bare', '--quiet', mirror_path(source), target)
+    saved = max(0, objects_size(target) - fetched) if hit else 0
+    report(hit, saved)
+    return f"/srv/{SECRETS_DIRECTORY}/source.git", hit, saved
+
+
+def report(hit, saved):
+    with _stats_lock:
+        _stats["hits" if hit else "misses"] += 1
+        _stats["bytes_saved"] += saved
+        hits, misses, total = _stats["hits"], _stats["misses"], _stats["bytes_saved"]
+    print(f"Git mirror {'hit' if hit else 'miss'}: {saved} bytes saved ({hits} hits, {misses} misses, {total} bytes saved)")
@@ -1,10 +1,77 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from sisyphe.celery import app
 
+class Hypervisor(models.Model):
+    # A host running a worker, which consumes the queue named after it
+    name = models.CharField(max_length=100, unique=True)
+    enabled = models.BooleanField(default=True)
+    # Reported by the heartbeat of the node, memory in MiB
+    total_memory = models.IntegerField(default=0)
+    free_memory = models.IntegerField(default=0)
+    cpus = models.IntegerField(default=0)
+    # JSON list of [NUMA node, [CPUs of the core]] for the pinnable cores
+    cores = models.TextField(default='[]')
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def queue(self):
+        return f"hypervisor.{self.name}"
+
+    def __str__(self):
+        return self.name
+
+class ResourceProfile(models.Model):
+    CACHE_MODES = [
+        ('', 'Hypervisor default'),
+        ('none', 'none'),
+        ('writethrough', 'writethrough'),
+        ('writeback', 'writeback'),
+        ('directsync', 'directsync'),
+        ('unsafe', 'unsafe'),
+    ]
+    IO_MODES = [
+        ('', 'Hypervisor default'),
+        ('threads', 'threads'),
+        ('native', 'native'),
+        ('io_uring', 'io_uring'),
+    ]
+
+    DEVICES = [
+        ('legacy', 'e1000 user networking and 9p /srv'),
+        ('virtio', 'virtio-net through passt and virtiofs /srv'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    # Every vCPU gets a dedicated physical core, shared with no other run
+    pin_vcpus = models.BooleanField(default=False)
+    hugepages = models.BooleanField(default=False)
+    # Host NUMA node holding the memory and the pinned cores, any node when empty
+    numa_node = models.IntegerField(null=True, blank=True)
+    disk_cache = models.CharField(max_length=16, choices=CACHE_MODES, blank=True, default='')
+    disk_io = models.CharField(max_length=16, choices=IO_MODES, blank=True, default='')
+    iothreads = models.IntegerField(default=0)
+    devices = models.CharField(max_length=16, choices=DEVICES, default='legacy')
+
+    def clean(self):
+        if self.disk_io == 'native' and self.disk_cache not in ('none', 'directsync'):
+            raise ValidationError("io='native' needs the 'none' or 'directsync' cache mode")
+
+    def __str__(self):
+        return self.name
+
 class Campaign(models.Model):
     name = models.CharField(max_length=100)
     source = models.URLField()
     duration = models.IntegerField(default=600)
+    memory = models.IntegerField(default=2048)
+    vcpus = models.IntegerField(default=2)
+    priority = models.IntegerField(default=0)
+    # Volumes of sensitive campaigns are overwritten before being deleted
+    sensitive = models.BooleanField(default=False)
+    profile = models.ForeignKey(ResourceProfile, null=True, blank=True, on_delete=models.SET_NULL)
+    # Runs only on this node when set, e.g. the one serving the artifacts
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.SET_NULL)
 
     def __str__(self):
         return f"{self.name} -> {self.source}"
@@ -13,12 +80,40 @@ class Run(models.Model):
     start = models.DateTimeField(auto_now_add=True)
     end = models.DateTimeField(null=True, blank=True)
     campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
-    uuid = models.CharField(max_length=100, default='')
+    uuid = models.CharField(max_length=100, default='', unique=True)
     hidden = models.BooleanField(default=True)
+    memory = models.IntegerField(default=2048)
+    vcpus = models.IntegerField(default=2)
+    enqueued = models.DateTimeField(null=True, blank=True)
+    stop_requested = models.DateTimeField(null=True, blank=True)
+    reclaimed = models.DateTimeField(null=True, blank=True)
+    dedup_saved = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(null=True, blank=True)
+    total_bytes = models.BigIntegerField(null=True, blank=True)
+    scheduled = models.DateTimeField(null=True, blank=True)
+    # End of the provisioning, successful or not
+    provisioned = models.DateTimeField(null=True, blank=True)
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['campaign', 'hidden', 'start']),
+        ]
 
     def __str__(self):
         return f"{self.campaign.name} -- {self.uuid}"
 
+class QueuedRun(models.Model):
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
+    priority = models.IntegerField(default=0)
+    enqueued = models.DateTimeField(auto_now_add=True)
+    # Schedule slot the run belongs to, and the jittered time before which it is not admitted
+    scheduled = models.DateTimeField(null=True, blank=True)
+    not_before = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.campaign.name} queued at {self.enqueued}"
+
 class EnvironmentVariable(models.Model):
     campaign = models.ManyToManyField(Campaign)
     key = models.TextField()
@@ -34,3 +129,114 @@ class RunInformation(models.Model):
 
     def __str__(self):
         return f"{self.key} -> {self.value}"
+
+class WarmVolume(models.Model):
+    uuid = models.CharField(max_length=100, unique=True)
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.CASCADE)
+    backing_image = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.uuid} -> {self.backing_image}"
+
+class PortLease(models.Model):
+    port = models.IntegerField()
+    run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    expires = models.DateTimeField()
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [('hypervisor', 'port')]
+        # NULL never equals NULL: rows without a node need their own constraint
+        constraints = [
+            models.UniqueConstraint(fields=['port'], condition=models.Q(hypervisor__isnull=True), name='portlease_port_without_hypervisor'),
+        ]
+
+    def __str__(self):
+        return f"{self.port} -> {self.run.uuid}"
+
+class Timer(models.Model):
+    ACTIONS = [
+        ('stop', 'Stop the domain'),
+        ('cleanup', 'Enforce the shutdown deadline'),
+    ]
+
+    run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    action = models.CharField(max_length=16, choices=ACTIONS)
+    due = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = [('run', 'action')]
+
+    def __str__(self):
+        return f"{self.action} {self.run.uuid} at {self.due}"
+
+class Blob(models.Model):
+    key = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    runs = models.ManyToManyField(Run)
+    # Each node has its own blob store
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [('hypervisor', 'key')]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(hypervisor__isnull=True), name='blob_key_without_hypervisor'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.size} bytes)"
+
+class SampleChunk(models.Model):
+    # Consecutive resource samples of a run, one packed float64 array per column
+    run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    count = models.IntegerField()
+    # 0 for raw samples, 1 once downsampled
+    level = models.SmallIntegerField(default=0)
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'start']),
+            models.Index(fields=['level', 'start']),
+        ]
+
+    def __str__(self):
+        return f"{self.count} samples of {self.run.uuid} from {self.start}"
+
+class CpuPin(models.Model):
+    # One row per host CPU held by a pinned run, vcpu is empty for the siblings of a core
+    cpu = models.IntegerField()
+    run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    vcpu = models.IntegerField(null=True, blank=True)
+    node = models.IntegerField(default=0)
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [('hypervisor', 'cpu')]
+        constraints = [
+            models.UniqueConstraint(fields=['cpu'], condition=models.Q(hypervisor__isnull=True), name='cpupin_cpu_without_hypervisor'),
+        ]
+
+    def __str__(self):
+        return f"CPU {self.cpu} -> {self.run.uuid}"
+
+class BackingImage(models.Model):
+    # Local copy of an image of the Nix store, shared by the overlays built on it
+    source = models.CharField(max_length=255)
+    digest = models.CharField(max_length=64, db_index=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    verified = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    hypervisor = models.ForeignKey(Hypervisor, null=True, blank=True, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = [('hypervisor', 'source')]
+        constraints = [
+            models.UniqueConstraint(fields=['source'], condition=models.Q(hypervisor__isnull=True), name='backingimage_source_without_hypervisor'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} -> {self.path}"
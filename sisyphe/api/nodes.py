@@ -0,0 +1,76 @@
+import datetime, json, threading, time
+
+from celery.signals import celeryd_after_setup, worker_ready
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import models
+
+_local = None
+
+
+def local():
+    # The node this process runs on
+    global _local
+    if _local is None:
+        _local, _ = models.Hypervisor.objects.get_or_create(name=settings.SISYPHE_HYPERVISOR_NAME)
+    return _local
+
+
+def local_queue():
+    return models.Hypervisor(name=settings.SISYPHE_HYPERVISOR_NAME).queue
+
+
+def queue_of(run):
+    # Tasks touching the domain, the volume or the directory of a run go to its node
+    return run.hypervisor.queue if run.hypervisor_id else None
+
+
+def owned(runs):
+    return runs.filter(hypervisor=local())
+
+
+def live():
+    limit = timezone.now() - datetime.timedelta(seconds=settings.SISYPHE_HEARTBEAT_TIMEOUT)
+    return models.Hypervisor.objects.filter(enabled=True, heartbeat__gte=limit)
+
+
+def host_capacity(connection):
+    # getInfo reports the memory in MiB, getFreeMemory in bytes
+    info = connection.getInfo()
+    return info[1], info[2], connection.getFreeMemory() // (1024 * 1024)
+
+
+def heartbeat(connection):
+    from . import cpus
+    total_memory, host_cpus, free_memory = host_capacity(connection)
+    models.Hypervisor.objects.update_or_create(name=settings.SISYPHE_HYPERVISOR_NAME, defaults={
+        'total_memory': total_memory,
+        'free_memory': free_memory,
+        'cpus': host_cpus,
+        'cores': json.dumps([[core.node, core.cpus] for core in cpus.topology(connection)]),
+        'heartbeat': timezone.now(),
+    })
+
+
+def beat_forever():
+    # libvirt is only needed on the nodes
+    from . import hypervisor
+    while True:
+        close_old_connections()
+        try:
+            heartbeat(hypervisor.get_connection())
+        except Exception as e:
+            print(f"Heartbeat of {settings.SISYPHE_HYPERVISOR_NAME} failed: {e}")
+        time.sleep(settings.SISYPHE_HEARTBEAT_INTERVAL)
+
+
+@celeryd_after_setup.connect
+def consume_local_queue(sender, instance, **kwargs):
+    instance.app.amqp.queues.select_add(local_queue())
+
+
+@worker_ready.connect
+def start_heartbeat(**kwargs):
+    threading.Thread(target=beat_forever, daemon=True).start()
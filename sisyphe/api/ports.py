@@ -0,0 +1,50 @@
+import datetime, random, socket
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import models
+
+
+def is_bindable(port):
+    # Catches ports held by anything else on the host, e.g. a domain still shutting down
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('', port))
+        except OSError:
+            return False
+    return True
+
+
+def lease(run, duration):
+    start, end = settings.SISYPHE_SSH_PORT_RANGE
+    size = end - start + 1
+    now = timezone.now()
+    expires = now + duration + datetime.timedelta(minutes=settings.SISYPHE_PORT_LEASE_GRACE)
+
+    # Random probing: the expected number of probes only depends on the occupancy
+    offset = random.randrange(size)
+    for i in range(size):
+        port = start + (offset + i) % size
+        if not is_bindable(port):
+            continue
+        try:
+            with transaction.atomic():
+                models.PortLease.objects.create(port=port, run=run, hypervisor_id=run.hypervisor_id, expires=expires)
+            return port
+        except IntegrityError:
+            # Take the port back from a run that crashed without releasing it
+            if models.PortLease.objects.filter(port=port, hypervisor_id=run.hypervisor_id, expires__lt=now).update(run=run, expires=expires):
+                return port
+    raise RuntimeError(f"No free SSH port left between {start} and {end}")
+
+
+def shorten(run_id, duration):
+    expires = timezone.now() + duration
+    models.PortLease.objects.filter(run_id=run_id, expires__gt=expires).update(expires=expires)
+
+
+def release(run_id):
+    models.PortLease.objects.filter(run_id=run_id).delete()
@@ -0,0 +1,149 @@
+import datetime, os, re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import artifacts, caching, dedup, hypervisor, injection, models, nodes, volumes
+from .hypervisor import POOL_PATH
+
+import libvirt
+
+UUID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+Snapshot = namedtuple('Snapshot', ['domains', 'volumes', 'directories', 'known', 'runs', 'leases', 'timers'])
+RunState = namedtuple('RunState', ['pk', 'uuid', 'start', 'end', 'hidden', 'reclaimed', 'stop_requested', 'file_count', 'duration', 'sensitive'])
+
+FIXES = [
+    'destroy_domains', 'reclaim_runs', 'schedule_stops', 'schedule_cleanups', 'fix_rows',
+    'drop_leases', 'drop_timers', 'delete_volumes', 'remove_directories', 'build_manifests',
+]
+
+
+def take_snapshot(connection, pool):
+    # One call or query per source, everything else is computed in memory
+    pool.refresh(0)
+    domains = {domain.name(): domain.isActive() for domain in connection.listAllDomains(0)}
+    volume_names = {}
+    for name in pool.listVolumes():
+        match = volumes.VOLUME_PATTERN.match(name)
+        if match:
+            volume_names[match.group(1)] = name
+    with os.scandir(settings.SISYPHE_ARTIFACTS_ROOT) as it:
+        directories = {item.name for item in it if UUID_PATTERN.match(item.name) and item.is_dir(follow_symlinks=False)}
+    # The artifacts are shared: a directory belongs to a run of any node
+    known = set(models.Run.objects.values_list('uuid', flat=True))
+    # Every node only looks after its own runs, domains and volumes
+    owned = nodes.owned(models.Run.objects.all())
+    runs = {
+        state.uuid: state for state in map(RunState._make, owned.values_list(
+            'pk', 'uuid', 'start', 'end', 'hidden', 'reclaimed', 'stop_requested', 'file_count',
+            'campaign__duration', 'campaign__sensitive',
+        ))
+    }
+    # Port leases and pinned CPUs are both held until the run is reclaimed
+    leases = (
+        set(models.PortLease.objects.filter(run__in=owned).values_list('run_id', flat=True))
+        | set(models.CpuPin.objects.filter(run__in=owned).values_list('run_id', flat=True))
+    )
+    timers = set(models.Timer.objects.filter(run__in=owned).values_list('run_id', 'action'))
+    return Snapshot(domains, volume_names, directories, known, runs, leases, timers)
+
+
+def plan(snapshot, now):
+    fixes = {name: [] for name in FIXES}
+    grace = datetime.timedelta(seconds=settings.SISYPHE_RECONCILE_GRACE)
+    deadline = datetime.timedelta(seconds=settings.SISYPHE_SHUTDOWN_DEADLINE)
+
+    for name, active in snapshot.domains.items():
+        run = snapshot.runs.get(name)
+        # Only domains named after a run belong to sisyphe
+        if active and UUID_PATTERN.match(name) and (run is None or run.reclaimed):
+            fixes['destroy_domains'].append(name)
+
+    for run in snapshot.runs.values():
+        if run.reclaimed is None:
+            if snapshot.domains.get(run.uuid):
+                if (run.pk, 'stop') not in snapshot.timers and run.stop_requested is None:
+                    fixes['schedule_stops'].append((run.pk, run.start + datetime.timedelta(minutes=run.duration)))
+                elif run.stop_requested is not None and (run.pk, 'cleanup') not in snapshot.timers:
+                    fixes['schedule_cleanups'].append((run.pk, run.stop_requested + deadline))
+            elif run.start < now - grace:
+                # Never provisioned, or the domain went away without anybody noticing
+                fixes['reclaim_runs'].append(run)
+            continue
+
+        if run.hidden or run.end is None:
+            fixes['fix_rows'].append(run.pk)
+        if run.pk in snapshot.leases:
+            fixes['drop_leases'].append(run.pk)
+        if any((run.pk, action) in snapshot.timers for action, _ in models.Timer.ACTIONS):
+            fixes['drop_timers'].append(run.pk)
+        if run.uuid in snapshot.volumes and not snapshot.domains.get(run.uuid):
+            fixes['delete_volumes'].append(run.uuid)
+        if run.file_count is None and run.uuid in snapshot.directories:
+            fixes['build_manifests'].append(run.pk)
+
+    for run in fixes['reclaim_runs']:
+        if run.uuid in snapshot.volumes:
+            fixes['delete_volumes'].append(run.uuid)
+        if run.uuid in snapshot.directories:
+            fixes['build_manifests'].append(run.pk)
+
+    # Directories left behind by deleted runs, whichever node ran them
+    fixes['remove_directories'] = sorted(snapshot.directories - snapshot.known)
+    return fixes
+
+
+def apply(fixes, snapshot, pool, now):
+    for name in fixes['destroy_domains']:
+        domain = hypervisor.lookup_domain(name)
+        try:
+            if domain is not None:
+                domain.destroy()
+        except libvirt.libvirtError as e:
+            print(f"Could not destroy {name}: {e}")
+        hypervisor.forget_domain(name)
+
+    reclaimed = [run.pk for run in fixes['reclaim_runs']]
+    if reclaimed:
+        models.Run.objects.filter(pk__in=reclaimed, reclaimed__isnull=True).update(
+            reclaimed=now, end=Coalesce('end', now), hidden=False,
+        )
+        for run in fixes['reclaim_runs']:
+            hypervisor.forget_domain(run.uuid)
+            injection.cleanup(POOL_PATH, run.uuid, artifacts.run_directory(run.uuid))
+
+    if fixes['fix_rows']:
+        models.Run.objects.filter(pk__in=fixes['fix_rows']).update(end=Coalesce('end', 'reclaimed'), hidden=False)
+    caching.invalidate_runs(fixes['fix_rows'] + reclaimed)
+    models.PortLease.objects.filter(run_id__in=fixes['drop_leases'] + reclaimed).delete()
+    models.CpuPin.objects.filter(run_id__in=fixes['drop_leases'] + reclaimed).delete()
+    models.Timer.objects.filter(run_id__in=fixes['drop_timers'] + reclaimed).delete()
+    models.Timer.objects.bulk_create(
+        [models.Timer(run_id=pk, action='stop', due=due) for pk, due in fixes['schedule_stops']]
+        + [models.Timer(run_id=pk, action='cleanup', due=due) for pk, due in fixes['schedule_cleanups']],
+        ignore_conflicts=True,
+    )
+
+    names = {uuid: snapshot.volumes[uuid] for uuid in fixes['delete_volumes']}
+    sensitive = {uuid for uuid in names if snapshot.runs[uuid].sensitive}
+    volumes.delete_volumes(pool, names, sensitive)
+
+    for uuid in fixes['remove_directories']:
+        dedup.remove_run_directory(uuid)
+
+
+def reconcile(connection, dry_run=False):
+    now = timezone.now()
+    pool = hypervisor.get_pool()
+    snapshot = take_snapshot(connection, pool)
+    fixes = plan(snapshot, now)
+    if not dry_run:
+        apply(fixes, snapshot, pool, now)
+    return fixes
+
+
+def report(fixes):
+    return ", ".join(f"{len(fixes[name])} {name.replace('_', ' ')}" for name in FIXES if fixes[name]) or "nothing to fix"
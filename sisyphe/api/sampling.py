@@ -0,0 +1,86 @@
+import zlib
+from array import array
+
+from . import models
+
+# Offset in seconds from the start of the chunk, then one column per metric
+COLUMNS = ('time', 'cpu.time', 'balloon.current', 'balloon.rss', 'block.rd.bytes', 'block.wr.bytes', 'net.rx.bytes', 'net.tx.bytes')
+# Cumulative counters are served as rates per second
+COUNTERS = {'cpu.time', 'block.rd.bytes', 'block.wr.bytes', 'net.rx.bytes', 'net.tx.bytes'}
+
+
+def pack(columns):
+    return zlib.compress(b''.join(array('d', column).tobytes() for column in columns))
+
+
+def unpack(data, count):
+    values = array('d')
+    values.frombytes(zlib.decompress(data))
+    return [values[i * count:(i + 1) * count] for i in range(len(COLUMNS))]
+
+
+def merge(chunks):
+    # Columns of several chunks of a run, times relative to the first one
+    merged = [array('d') for _ in COLUMNS]
+    origin = None
+    for start, count, data in chunks:
+        columns = unpack(data, count)
+        origin = origin or start
+        shift = (start - origin).total_seconds()
+        merged[0].extend(t + shift for t in columns[0])
+        for column, values in zip(merged[1:], columns[1:]):
+            column.extend(values)
+    return origin, merged
+
+
+def reduce(columns, width):
+    # Keeps the last sample of every window of width seconds: exact for counters, a sample for gauges
+    reduced = [array('d') for _ in COLUMNS]
+    times = columns[0]
+    for i in range(len(times)):
+        if i + 1 < len(times) and times[i + 1] // width == times[i] // width:
+            continue
+        for target, column in zip(reduced, columns):
+            target.append(column[i])
+    return reduced
+
+
+def downsample(before, width):
+    # One chunk per run replaces all its raw chunks older than before
+    downsampled = 0
+    for run_id in models.SampleChunk.objects.filter(level=0, start__lt=before).values_list('run_id', flat=True).distinct():
+        chunks = models.SampleChunk.objects.filter(run_id=run_id, level=0, start__lt=before).order_by('start')
+        pks, rows = [], []
+        for pk, start, count, data in chunks.values_list('pk', 'start', 'count', 'data'):
+            pks.append(pk)
+            rows.append((start, count, data))
+        origin, columns = merge(rows)
+        columns = reduce(columns, width)
+        models.SampleChunk.objects.create(run_id=run_id, start=origin, count=len(columns[0]), level=1, data=pack(columns))
+        models.SampleChunk.objects.filter(pk__in=pks).delete()
+        downsampled += len(pks)
+    return downsampled
+
+
+def series(run_id, points):
+    chunks = models.SampleChunk.objects.filter(run_id=run_id).order_by('start').values_list('start', 'count', 'data')
+    origin, columns = merge(chunks)
+    if origin is None:
+        return None
+    times = columns[0]
+    if len(times) > points:
+        columns = reduce(columns, (times[-1] - times[0]) / points or 1)
+        times = columns[0]
+
+    result = {'start': origin.isoformat(), 'time': list(times)}
+    for name, column in zip(COLUMNS[1:], columns[1:]):
+        if name in COUNTERS:
+            rates = [0.0] + [
+                (column[i] - column[i - 1]) / (times[i] - times[i - 1]) if times[i] > times[i - 1] else 0.0
+                for i in range(1, len(column))
+            ]
+            # Nanoseconds of CPU time per second, as a number of busy vCPUs
+            result[name] = [rate / 1e9 for rate in rates] if name == 'cpu.time' else rates
+        else:
+            result[name] = list(column)
+    return result
@@ -0,0 +1,43 @@
+from rest_framework import serializers
+
+from .models import Campaign, Run, EnvironmentVariable, RunInformation
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    # Only keeps the fields listed in ?fields=a,b,c when the parameter is given
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get('fields') if request is not None else None
+        if requested:
+            allowed = set(requested.split(','))
+            for name in set(self.fields) - allowed:
+                self.fields.pop(name)
+
+
+class CampaignSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Campaign
+        fields = ['id', 'name', 'source', 'duration', 'memory', 'vcpus', 'priority', 'sensitive', 'profile', 'hypervisor']
+
+
+class RunSerializer(DynamicFieldsModelSerializer):
+    campaign_name = serializers.CharField(source='campaign.name', read_only=True)
+
+    class Meta:
+        model = Run
+        fields = ['id', 'uuid', 'campaign', 'campaign_name', 'start', 'end', 'hidden', 'memory', 'vcpus', 'enqueued', 'file_count', 'total_bytes', 'scheduled', 'provisioned', 'hypervisor']
+
+
+class EnvironmentVariableSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = EnvironmentVariable
+        fields = ['id', 'campaign', 'key', 'value']
+
+
+class RunInformationSerializer(DynamicFieldsModelSerializer):
+    runs = serializers.PrimaryKeyRelatedField(source='campaign', many=True, read_only=True)
+
+    class Meta:
+        model = RunInformation
+        fields = ['id', 'runs', 'key', 'value']
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from sisyphe.celery import app
+from . import caching, nodes
+from .models import Campaign, QueuedRun, Run
+
+
+@receiver(post_delete, sender=Run)
+def remove_run_artifacts(sender, instance, **kwargs):
+    # By name, so that the web process does not need to import the tasks
+    uuid = instance.uuid
+    # The artifacts live on the node that ran it
+    queue = nodes.queue_of(instance)
+    transaction.on_commit(lambda: app.send_task('api.tasks.removeRunArtifacts', (uuid,), queue=queue))
+
+
+@receiver(post_save, sender=Run)
+@receiver(post_delete, sender=Run)
+def invalidate_run(sender, instance, **kwargs):
+    caching.invalidate('run', instance.pk)
+    caching.invalidate('campaign', instance.campaign_id)
+    # Every list of the runs API
+    caching.invalidate('runs')
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_campaign(sender, instance, **kwargs):
+    caching.invalidate_campaign(instance.pk)
+
+
+@receiver(post_save, sender=Campaign)
+def stage_image(sender, instance, **kwargs):
+    # Runs are about to be queued: each node stages the image ahead of provisioning them
+    def send():
+        for node in nodes.live():
+            app.send_task('api.tasks.stageImage', queue=node.queue)
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=QueuedRun)
+@receiver(post_delete, sender=QueuedRun)
+def invalidate_queue(sender, instance, **kwargs):
+    # The campaign page shows its queue
+    caching.invalidate('campaign', instance.campaign_id)
@@ -1,155 +1,104 @@
+from django.conf import settings
+from django.db import OperationalError
+from django.utils import timezone
 from sisyphe.celery import app
-from . import models
-import subprocess, os, random, signal, time, string, uuid, datetime, tempfile, json
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend
+from . import artifacts, caching, models, warmpool, injection, hypervisor, admission, ports, timers, keys, dedup, manifest, volumes, reconcile, tracing, sampling, cpus, domain, mirrors, images, nodes
+from .hypervisor import POOL_NAME, POOL_PATH
+import subprocess, os, random, signal, time, string, uuid, datetime, tempfile, json, fcntl
+import xml.etree.ElementTree as ET
 import libvirt
 
 
+def backing_image_path():
+    return images.current()
+
+
+def volume_name(uuid):
+    return f"volume_{uuid}_nixos.qcow2"
+
+
+def create_overlay(pool, name, backing_image_path):
+    volumeXML = f'''
+        <volume type='file'>
+            <name>{name}</name>
+            <capacity unit='G'>10</capacity>
+            <allocation>0</allocation>
+            <target>
+                    <format type='qcow2'/>
+                    <permissions>
+                    <mode>0600</mode>
+                    </permissions>
+            </target>
+            <backingStore>
+                    <path>{backing_image_path}</path>
+                    <format type='qcow2'/>
+            </backingStore>
+        </volume>
+    '''
+    return pool.createXML(volumeXML)
+
+
 class LibVirtWorker:
-    def __init__(self, instance_id):
-        self.pool_name = "sisyphe-disks"
-        self.pool_path = "/var/tmp"
-        self.uuid = str(uuid.uuid4())
-        self.instance_id = instance_id
-        self.volume_name = f"volume_{self.uuid}_nixos.qcow2"
+    def __init__(self, run_id, volume_uuid=None, phases=None):
+        self.pool_name = POOL_NAME
+        self.pool_path = POOL_PATH
+        self.run = models.Run.objects.select_related('campaign__profile').get(pk=run_id)
+        self.campaign = self.run.campaign
+        self.instance_id = self.campaign.id
+        # A pre-warmed overlay already carries the uuid of the run that claims it
+        if volume_uuid is not None:
+            self.run.uuid = volume_uuid
+            self.run.save(update_fields=['uuid'])
+        self.uuid = self.run.uuid
+        self.prewarmed = volume_uuid is not None
+        self.volume_name = volume_name(self.uuid)
         self.environment = os.environ.copy()
-        self.backing_image_path = self.environment["SISYPHE_ISO_PATH"] + "/nixos.qcow2"
-
-        self.campaign = models.Campaign.objects.get(id=self.instance_id)
-        self.run = models.Run.objects.create(campaign=self.campaign, uuid=self.uuid)
+        self.backing_image_path = backing_image_path()
 
         # Generate Unique Directory
-        self.dirname = f"/home/sisyphe/{self.uuid}"
+        self.dirname = artifacts.run_directory(self.uuid)
         os.makedirs(self.dirname)
         # SSH
-        self.ssh_port = random.randint(10000, 40000)
+        self.ssh_port = ports.lease(self.run, datetime.timedelta(minutes=self.campaign.duration))
         self.private_key = None
         self.public_key = None
+        self.extra_devices = []
+        self.phases = phases or tracing.PhaseTimer()
 
     def connect(self):
-        try:
-            self.connection = libvirt.open(None)
-        except libvirt.libvirtError:
-            print('Failed to open connection to the hypervisor')
-            exit(1)
+        self.connection = hypervisor.get_connection()
 
     def disconnect(self):
-        self.connection.close()
+        # The connection is shared by the worker process and stays open
         self.connection = None
 
     def ensure_pool_exists(self):
-        try:
-            self.pool = self.connection.storagePoolLookupByName(self.pool_name)
-        except libvirt.libvirtError:
-            print("The pool does not exist")
-            poolXML = f'''
-            <pool type='dir'>
-              <name>{self.pool_name}</name>
-              <uuid/>
-              <source>
-              </source>
-              <target>
-                <path>{self.pool_path}</path>
-                <permissions>
-                  <mode>0755</mode>
-                  <owner>-1</owner>
-                  <group>-1</group>
-                </permissions>
-              </target>
-            </pool>
-            '''
-            self.pool = self.connection.storagePoolDefineXML(poolXML, 0)
-            self.pool.setAutostart(1)
-            self.pool.create()
-        if not self.pool.isActive():
-            self.pool.create()
+        self.pool = hypervisor.get_pool(self.pool_name, self.pool_path)
 
     def create_volume(self):
+        if self.prewarmed:
+            try:
+                self.pool.storageVolLookupByName(self.volume_name)
+                print(f"Using the pre-warmed volume {self.volume_name}")
+                return
+            except libvirt.libvirtError:
+                print(f"The pre-warmed volume {self.volume_name} is gone, creating it again")
         print(f"Backing image path: {self.backing_image_path}")
-        volumeXML = f'''
-            <volume type='file'>
-                <name>{self.volume_name}</name>
-                <capacity unit='G'>10</capacity>
-                <target>
-                        <format type='qcow2'/>
-                        <permissions>
-                        <mode>0600</mode>
-                        </permissions>
-                </target>
-                <backingStore>
-                        <path>{self.backing_image_path}</path>
-                        <format type='qcow2'/>
-                </backingStore>
-            </volume>
-        '''
-        self.pool.createXML(volumeXML)
+        create_overlay(self.pool, self.volume_name, self.backing_image_path)
 
     def create_domain(self):
-        domainXML = f'''
-            <domain type='kvm' id='2' xmlns:qemu='http://libvirt.org/schemas/domain/qemu/1.0'>
-                    <name>{self.uuid}</name>
-                    <memory unit='GiB'>2</memory>
-                    <vcpu placement='static'>2</vcpu>
-                    <os>
-                            <type arch='x86_64' machine='pc-q35-6.0'>hvm</type>
-                            <boot dev='hd'/>
-                    </os>
-                    <features>
-                            <acpi/>
-                            <apic/>
-                    </features>
-                    <devices>
-                            <emulator>/run/current-system/sw/bin/qemu-system-x86_64</emulator>
-                            <disk type="volume" device="disk">
-                                    <driver name='qemu' type='qcow2' />
-                                    <source type="volume" pool="{self.pool_name}" volume="{self.volume_name}" />
-                                    <backingStore type='file'>
-                                        <source file='{self.backing_image_path}'/>
-                                        <format type='qcow2'/>
-                                    </backingStore>
-                                    <target dev="vda" bus="virtio"/>
-                                    <alias name='virtio-disk0'/>
-                                    <address type='pci' domain='0x0000' bus='0x04' slot='0x00' function='0x0'/>
-                            </disk>
-                            <filesystem type='mount' accessmode='squash'>
-                                    <source dir='{self.dirname}'/>
-                                    <target dir='srv'/>
-                                    <alias name='fs0'/>
-                                    <address type='pci' domain='0x0000' bus='0x01' slot='0x00' function='0x0'/>
-                            </filesystem>
-                            <serial type='pty'>
-                                    <source path='/dev/pts/3'/>
-                                    <target type='isa-serial' port='0'>
-                                            <model name='isa-serial'/>
-                                    </target>
-                                    <alias name='serial0'/>
-                            </serial>
-                            <console type='pty' tty='/dev/pts/3'>
-                                    <source path='/dev/pts/3'/>
-                                    <target type='serial' port='0'/>
-                                    <alias name='serial0'/>
-                            </console>
-                    </devices>
-                    <qemu:commandline>
-                            <qemu:arg value='-netdev'/>
-                            <qemu:arg value='user,id=mynet.0,net=10.0.10.0/24,hostfwd=tcp::{self.ssh_port}-:22'/>
-                            <qemu:arg value='-device'/>
-                            <qemu:arg value='e1000,netdev=mynet.0'/>
-                    </qemu:commandline>
-            </domain>
-        '''
-        self.connection.createXML(domainXML)
+        profile = self.campaign.profile
+        pins, node = cpus.pins(self.run.pk)
+        shared = cpus.shared_cpus(self.connection.getInfo()[2])
+        domainXML = domain.build(self, profile, pins, node, shared)
+        created = self.connection.createXML(domainXML)
+        hypervisor.remember_domain(self.uuid, created)
 
     def configure_domain(self):
         # Configure SSH
         print(f"The ssh server will run on {self.ssh_port}")
-        key = rsa.generate_private_key(backend=default_backend(), public_exponent=65537, key_size=2048)
-        pub_key = key.public_key().public_bytes(serialization.Encoding.OpenSSH, serialization.PublicFormat.OpenSSH)
-        pem = key.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.TraditionalOpenSSL, encryption_algorithm=serialization.NoEncryption())
-        self.private_key = pem.decode('utf-8')
-        self.public_key = pub_key.decode('utf-8')
+        with self.phases.phase('keygen'):
+            self.private_key, self.public_key = keys.get_provider().generate()
 
         # Expose the ssh port on the host
         self.environment["QEMU_NET_OPTS"] = f"hostfwd=tcp::{self.ssh_port}-:22"
@@ -162,110 +111,275 @@ class LibVirtWorker:
                 custom_env_list.append(f'{env_var.key}="{env_var.value}"\n')
                 custom_env[env_var.key] = env_var.value
 
+        repository = self.campaign.source
+        if settings.SISYPHE_MIRROR_ROOT:
+            with self.phases.phase('mirror'):
+                try:
+                    repository, hit, saved = mirrors.checkout(self.campaign.source, self.dirname)
+                    self.phases.note('mirror.hit', int(hit))
+                    self.phases.note('mirror.bytes_saved', saved)
+                except (OSError, subprocess.SubprocessError) as e:
+                    print(f"Could not mirror {self.campaign.source} ({e}), the guest clones it itself")
+
         print("Injecting secrets into the VM...")
-        tmp_env = tempfile.NamedTemporaryFile(mode='w+t')
-        guestfish_commands = tempfile.NamedTemporaryFile(mode='w+t')
-        tmp_env.write(
-                f'REPOSITORY="{self.campaign.source}"\n'
+        secrets = (
+                f'REPOSITORY="{repository}"\n'
+                f'REPOSITORY_UPSTREAM="{self.campaign.source}"\n'
                 f'SSH_PORT="{self.ssh_port}"\n'
                 f'SSH_HOST="{os.environ.get("DJANGO_HOST")}"\n'
                 f'SSH_USER="root"\n'
                 f'SSH_PUBLIC_KEY="{self.public_key}"\n'
                 f'SSH_PRIVATE_KEY="{self.private_key}"\n'
-                ''.join(custom_env_list)
+                # Lets the guest mount /srv with the right driver
+                f'SRV_FSTYPE="{"virtiofs" if domain.uses_virtio(self.campaign.profile) else "9p"}"\n'
+                + ''.join(custom_env_list)
                 )
-        tmp_env.file.flush()
+        injector = injection.get_injector()
+        with self.phases.phase('injection'):
+            try:
+                self.extra_devices += injector.inject(self, secrets)
+            except (OSError, subprocess.CalledProcessError) as e:
+                print(f"Injection with {injector.name} failed ({e}), falling back to guestfish")
+                injector = injection.GuestfishInjector()
+                self.extra_devices += injector.inject(self, secrets)
+        print(f"Secrets injected with {injector.name}")
 
-        guestfish_commands.write(
-                f'add /var/tmp/{self.volume_name}\n'
-                f'run\n'
-                f'mount /dev/sda1 /\n'
-                f'upload {tmp_env.name} /etc/sisyphe_secrets\n'
-                f'mkdir /root/.ssh/\n'
-                f'write /root/.ssh/authorized_keys "{self.public_key}"\n'
-                f'quit'
-        )
-        guestfish_commands.file.flush()
 
-        process = subprocess.run(f"guestfish --file {guestfish_commands.name}", shell=True, env=self.environment)
+@app.task
+def runCampaign(instance_id):
+    campaign = models.Campaign.objects.get(id=instance_id)
+    queued = admission.enqueue(campaign)
+    delay = (queued.not_before - timezone.now()).total_seconds()
+    print(f"Queueing a run of {campaign.name}, not before {queued.not_before}")
+    if delay > 0:
+        # A lost message only delays the run until the next periodic admission
+        admitRuns.apply_async(countdown=delay)
+    else:
+        admitRuns.delay()
 
+# Concurrent admissions may find the SQLite database locked
+@app.task(ignore_result=True, autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def admitRuns():
+    # Placement only needs the heartbeats, any worker can admit
+    admitted = admission.admit()
+    # The whole batch boots from the same image
+    for queue in {run.hypervisor.queue for run in admitted}:
+        prefetchBackingImage.apply_async(queue=queue)
+    for run in admitted:
+        print(f"Admitted run {run.uuid} of {run.campaign.name} on {run.hypervisor.name}")
+        provisionRun.apply_async((run.pk,), queue=run.hypervisor.queue)
+
+@app.task(ignore_result=True)
+def prefetchBackingImage():
+    images.prefetch(backing_image_path())
+
+@app.task(ignore_result=True)
+def onEveryHypervisor(name):
+    # Periodic maintenance of the pools, domains and directories each node owns
+    for node in nodes.live():
+        app.send_task(name, queue=node.queue)
+
+@app.task(ignore_result=True)
+def stageImage():
+    # Sent to every node when a campaign is saved, so that no run waits for the copy
+    source = images.source_path()
+    try:
+        images.stage(source)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not stage {source} ({e}), runs use it in place")
 
 @app.task
-def runCampaign(instance_id):
-    worker = LibVirtWorker(instance_id)
+def provisionRun(run_id):
+    try:
+        provision(run_id)
+    except Exception:
+        # Give the reserved resources back to the admission queue
+        models.Run.objects.filter(pk=run_id).update(end=timezone.now())
+        caching.invalidate_runs([run_id])
+        ports.release(run_id)
+        cpus.release(run_id)
+        admitRuns.delay()
+        raise
+
+def provision(run_id):
+    phases = tracing.PhaseTimer()
+    try:
+        provision_phases(run_id, phases)
+    finally:
+        now = timezone.now()
+        models.Run.objects.filter(pk=run_id).update(provisioned=now)
+        caching.invalidate_runs([run_id])
+        scheduled = models.Run.objects.filter(pk=run_id).values_list('scheduled', flat=True).first()
+        if scheduled is not None:
+            slip = (now - scheduled).total_seconds()
+            print(f"Run {run_id} started {slip:.1f}s after its scheduled time")
+            phases.note('dispatch.slip', f"{slip:.3f}")
+        # Failed provisionings are recorded too, with the phase that failed
+        phases.save(run_id)
+    # Frees a provisioning slot
+    admitRuns.delay()
 
-    print("Connect to the hypervisor")
-    worker.connect()
+def provision_phases(run_id, phases):
+    claim_started = time.monotonic()
+    with phases.phase('claim'):
+        volume_uuid = warmpool.claim(backing_image_path())
+    with phases.phase('setup'):
+        worker = LibVirtWorker(run_id, volume_uuid, phases)
 
-    print("Ensure the pool exists")
-    worker.ensure_pool_exists()
+    with phases.phase('connect'):
+        worker.connect()
 
-    print("Setting up environment")
-    environment = os.environ.copy()
+    with phases.phase('ensure_pool'):
+        worker.ensure_pool_exists()
 
-    print("Creating a volume for the VM…")
-    worker.create_volume()
+    with phases.phase('create_volume'):
+        worker.create_volume()
+    warmpool.report(phases, worker.prewarmed, time.monotonic() - claim_started)
+    if settings.SISYPHE_WARM_POOL_SIZE:
+        refillWarmPool.apply_async(queue=nodes.local_queue())
 
-    print("Configuring the VM…")
+    # keygen and injection
     worker.configure_domain()
 
-    print(f"Creating and launching the domain…")
-    worker.create_domain()
+    with phases.phase('create_domain'):
+        worker.create_domain()
 
-    print("Disconnect from the hypervisor")
     worker.disconnect()
 
-    stopCampaign.apply_async(
-        (worker.run.pk, worker.uuid,),   # args
-        eta=datetime.datetime.now() + datetime.timedelta(minutes=worker.campaign.duration)
-    )
+    timers.schedule(worker.run.pk, 'stop', timezone.now() + datetime.timedelta(minutes=worker.campaign.duration))
 
-@app.task(ignore_result=True)
+@app.task(ignore_result=True, autoretry_for=(libvirt.libvirtError, OperationalError), retry_backoff=True, max_retries=5)
 def stopCampaign(pk, uuid):
     print(f"Shutdown of the VM")
-    try:
-        connection = libvirt.open(None)
-        dom = connection.lookupByName(uuid)
-        dom.shutdown()
-        cleanupCampaign.apply_async(
-            (pk, uuid,),
-            eta=datetime.datetime.now() + datetime.timedelta(minutes=10)
-        )
-    except libvirt.libvirtError:
-        print('Failed to open connection to the hypervisor')
-        exit(1)
+    models.Run.objects.filter(pk=pk).update(stop_requested=timezone.now())
+    hypervisor.with_domain(uuid, lambda domain: domain.shutdown())
+    # The lifecycle watcher reclaims the run as soon as the domain stops,
+    # cleanupCampaign only enforces the deadline
+    deadline = datetime.timedelta(seconds=settings.SISYPHE_SHUTDOWN_DEADLINE)
+    ports.shorten(pk, deadline + datetime.timedelta(minutes=settings.SISYPHE_PORT_LEASE_GRACE))
+    timers.schedule(pk, 'cleanup', timezone.now() + deadline)
+
+@app.task(ignore_result=True, autoretry_for=(libvirt.libvirtError, OperationalError), retry_backoff=True, max_retries=5)
+def cleanupCampaign(pk, uuid):
+    print("Cleanup of the volumes")
+    if hypervisor.is_domain_active(uuid):
+        print(f"The domain {uuid} missed its shutdown deadline, destroying it")
+        hypervisor.with_domain(uuid, lambda domain: domain.destroy())
+    reclaim(pk, uuid)
+
+def reclaim(pk, uuid):
+    now = timezone.now()
+    # The watcher and the deadline may race, only the first one frees the resources
+    if not models.Run.objects.filter(pk=pk, reclaimed__isnull=True).update(reclaimed=now):
+        return False
     print("Update the database")
     run = models.Run.objects.get(pk=pk)
-    run.end = datetime.datetime.now()
+    run.end = run.end or now
     run.hidden = False
-    run.save()
+    run.save(update_fields=['end', 'hidden'])
 
-@app.task(ignore_result=True)
-def cleanupCampaign(pk, uuid):
-    print("Cleanup of the volumes")
+    hypervisor.forget_domain(uuid)
+    timers.cancel(pk)
+    ports.release(pk)
+    cpus.release(pk)
+    injection.cleanup(POOL_PATH, uuid, artifacts.run_directory(uuid))
+    pool = hypervisor.get_pool()
     try:
-        connection = libvirt.open(None)
-        dom = connection.lookupByName(uuid)
-        if dom.isActive():
-            cleanupCampaign.apply_async(
-                (pk, uuid,),
-                eta=datetime.datetime.now() + datetime.timedelta(minutes=10)
-            )
-        else:
-            pool = conn.storagePoolLookupByName('sisyphe-disks')
-            if not pool:
-                print('Failed to locate the sisyphe-disks storage pool')
-                exit(1)
-
-            volume_name = f"volume_{uuid}_nixos.qcow2"
-            vol = pool.storageVolLookupByName(volume_name)
-
-            if not vol:
-                print(f'Failed to locate the {volume_name} volume')
-                exit(1)
-
-            vol.wipe()
-            vol.delete()
+        volumes.reclaim_volume(pool.storageVolLookupByName(volume_name(uuid)), volumes.policy_for(run.campaign))
     except libvirt.libvirtError:
-        print('Failed to open connection to the hypervisor')
-        exit(1)
\ No newline at end of file
+        # Left to reapVolumes
+        print(f'Failed to delete the {volume_name(uuid)} volume')
+
+    if run.stop_requested:
+        print(f"Resources of {uuid} freed {timezone.now() - run.stop_requested} after the stop request")
+    admitRuns.delay()
+    buildManifest.apply_async((pk,), queue=nodes.local_queue())
+    return True
+
+@app.task(ignore_result=True)
+def buildManifest(pk):
+    run = models.Run.objects.get(pk=pk)
+    start = time.monotonic()
+    entries = manifest.update(run)
+    print(f"Manifest of {run.uuid}: {len(entries)} entries in {time.monotonic() - start:.2f}s")
+    deduplicateRun.apply_async((pk,), queue=nodes.local_queue())
+
+@app.task(ignore_result=True)
+def deduplicateRun(pk):
+    run = models.Run.objects.get(pk=pk)
+    saved = dedup.deduplicate(run)
+    print(f"Deduplication of {run.uuid} saved {saved} bytes")
+
+@app.task(ignore_result=True)
+def removeRunArtifacts(uuid):
+    dedup.remove_run_directory(uuid)
+    freed = dedup.collect()
+    print(f"Removed the artifacts of {uuid}, {freed} bytes of blobs collected")
+
+@app.task(ignore_result=True)
+def reapVolumes():
+    orphans = volumes.reap(hypervisor.get_connection())
+    if orphans:
+        print(f"Reaped {len(orphans)} orphan volumes")
+
+@app.task(ignore_result=True)
+def reconcileRuns(dry_run=False):
+    started = time.monotonic()
+    fixes = reconcile.reconcile(hypervisor.get_connection(), dry_run=dry_run)
+    print(f"Reconciliation{' (dry run)' if dry_run else ''} in {time.monotonic() - started:.2f}s: {reconcile.report(fixes)}")
+    if not dry_run:
+        for pk in fixes['build_manifests']:
+            buildManifest.apply_async((pk,), queue=nodes.local_queue())
+        if fixes['reclaim_runs']:
+            admitRuns.delay()
+    return fixes
+
+@app.task(ignore_result=True)
+def downsampleSamples():
+    before = timezone.now() - datetime.timedelta(seconds=settings.SISYPHE_SAMPLES_RAW_RETENTION)
+    merged = sampling.downsample(before, settings.SISYPHE_SAMPLES_DOWNSAMPLE_WIDTH)
+    if merged:
+        print(f"Downsampled {merged} raw sample chunks")
+
+@app.task(ignore_result=True)
+def collectBackingImages():
+    pool = hypervisor.get_pool()
+    pool.refresh(0)
+    referenced = set()
+    for vol in pool.listAllVolumes(0):
+        backing = ET.fromstring(vol.XMLDesc(0)).findtext('backingStore/path')
+        if backing:
+            referenced.add(backing)
+    for path in images.collect(referenced):
+        print(f"Removed the backing image {path}")
+
+@app.task(ignore_result=True)
+def refillWarmPool():
+    size = settings.SISYPHE_WARM_POOL_SIZE
+    warm = models.WarmVolume.objects.filter(hypervisor=nodes.local())
+    if not size and not warm.exists():
+        return
+    backing = backing_image_path()
+    pool = hypervisor.get_pool()
+
+    # Overlays built on a previous image are useless once the image changes
+    for stale in warm.exclude(backing_image=backing):
+        deleted, _ = models.WarmVolume.objects.filter(pk=stale.pk).delete()
+        if not deleted:
+            continue
+        try:
+            pool.storageVolLookupByName(volume_name(stale.uuid)).delete()
+        except libvirt.libvirtError:
+            print(f"Failed to delete the stale volume {volume_name(stale.uuid)}")
+
+    with open(os.path.join(POOL_PATH, '.warmpool.lock'), 'w') as lock:
+        # Every provisioning sends a refill: the ones arriving together count what
+        # the previous one left instead of each creating the same missing volumes
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        missing = size - warm.count()
+        for _ in range(missing):
+            volume_uuid = str(uuid.uuid4())
+            started = time.monotonic()
+            create_overlay(pool, volume_name(volume_uuid), backing)
+            models.WarmVolume.objects.create(uuid=volume_uuid, backing_image=backing, hypervisor=nodes.local())
+            print(f"Pre-warmed volume {volume_name(volume_uuid)} in {time.monotonic() - started:.3f}s")
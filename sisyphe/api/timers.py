@@ -0,0 +1,61 @@
+import datetime, heapq, time
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import models
+
+
+def schedule(run_id, action, due):
+    models.Timer.objects.update_or_create(run_id=run_id, action=action, defaults={'due': due})
+
+
+def cancel(run_id, action=None):
+    timers = models.Timer.objects.filter(run_id=run_id)
+    if action is not None:
+        timers = timers.filter(action=action)
+    timers.delete()
+
+
+class Dispatcher:
+    # Keeps the timers due soon in a heap and fires them as plain (non ETA) tasks
+    def __init__(self, actions, refresh=5.0, horizon=60.0):
+        self.actions = actions
+        self.refresh = refresh
+        self.horizon = horizon
+        self.heap = []
+        self.loaded = 0
+
+    def load(self):
+        close_old_connections()
+        limit = timezone.now() + datetime.timedelta(seconds=self.horizon)
+        self.heap = [
+            (due, pk, action, run_id, run_uuid, node)
+            for pk, due, action, run_id, run_uuid, node in models.Timer.objects
+                .filter(due__lte=limit)
+                .values_list('pk', 'due', 'action', 'run_id', 'run__uuid', 'run__hypervisor__name')
+        ]
+        heapq.heapify(self.heap)
+        self.loaded = time.monotonic()
+
+    def fire_due(self):
+        now = timezone.now()
+        while self.heap and self.heap[0][0] <= now:
+            due, pk, action, run_id, run_uuid, node = heapq.heappop(self.heap)
+            # Deleting the row claims the timer; it may also have been moved in the meantime
+            deleted, _ = models.Timer.objects.filter(pk=pk, due__lte=now).delete()
+            if deleted:
+                print(f"Firing {action} of run {run_uuid}, {(now - due).total_seconds():.1f}s after its deadline")
+                # Only the node running the domain can stop it
+                queue = models.Hypervisor(name=node).queue if node else None
+                self.actions[action].apply_async((run_id, run_uuid), queue=queue)
+
+    def run_forever(self):
+        while True:
+            if time.monotonic() - self.loaded >= self.refresh:
+                self.load()
+            self.fire_due()
+            wait = self.refresh - (time.monotonic() - self.loaded)
+            if self.heap:
+                wait = min(wait, (self.heap[0][0] - timezone.now()).total_seconds())
+            time.sleep(max(wait, 0.05))
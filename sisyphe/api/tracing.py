@@ -0,0 +1,129 @@
+import bisect, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from . import models
+
+KEY_PREFIX = 'provisioning.'
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SLIP_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class PhaseTimer:
+    # Durations of the provisioning phases of one run, written in one go at the end
+    def __init__(self):
+        self.durations = {}
+        self.notes = {}
+        self.failed = None
+
+    def note(self, key, value):
+        # Stored as is next to the durations
+        self.notes[key] = value
+
+    @contextmanager
+    def phase(self, name):
+        print(f"[{name}] started")
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.failed = name
+            raise
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.monotonic() - started
+            print(f"[{name}] took {self.durations[name]:.3f}s")
+
+    def save(self, run_id):
+        values = {f"{KEY_PREFIX}{name}": f"{seconds:.6f}" for name, seconds in self.durations.items()}
+        values[f"{KEY_PREFIX}total"] = f"{sum(self.durations.values()):.6f}"
+        if self.failed is not None:
+            values[f"{KEY_PREFIX}failed"] = self.failed
+        values.update((key, str(value)) for key, value in self.notes.items())
+        Link = models.RunInformation.campaign.through
+        # SQLite does not return the ids of a bulk insert, the links are the bulk part
+        with transaction.atomic():
+            informations = [models.RunInformation.objects.create(key=key, value=value) for key, value in values.items()]
+            Link.objects.bulk_create([Link(runinformation_id=information.pk, run_id=run_id) for information in informations])
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def histogram(name, description, observations, buckets=BUCKETS):
+    # observations yields (labels, seconds), labels being a tuple of (label, value) pairs
+    counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+    sums = defaultdict(float)
+    for labels, seconds in observations:
+        counts[labels][bisect.bisect_left(buckets, seconds)] += 1
+        sums[labels] += seconds
+
+    lines = [
+        f"# HELP {name} {description}",
+        f"# TYPE {name} histogram",
+    ]
+    for labels, counted in sorted(counts.items()):
+        rendered = ','.join(f'{label}="{escape(value)}"' for label, value in labels)
+        cumulated = 0
+        for bound, count in zip(buckets + ('+Inf',), counted):
+            cumulated += count
+            lines.append(f'{name}_bucket{{{rendered},le="{bound}"}} {cumulated}')
+        lines.append(f"{name}_sum{{{rendered}}} {sums[labels]:.6f}")
+        lines.append(f"{name}_count{{{rendered}}} {cumulated}")
+    return "\n".join(lines) + "\n"
+
+
+def phase_histograms():
+    Link = models.RunInformation.campaign.through
+    rows = Link.objects.filter(runinformation__key__startswith=KEY_PREFIX).exclude(
+        runinformation__key=f"{KEY_PREFIX}failed",
+    ).values_list('runinformation__key', 'runinformation__value', 'run__campaign__name')
+    return histogram(
+        'sisyphe_provisioning_phase_seconds',
+        "Duration of each provisioning phase of the runs",
+        (((('phase', key[len(KEY_PREFIX):]), ('campaign', campaign)), float(value)) for key, value, campaign in rows.iterator()),
+    )
+
+
+def slip_histograms():
+    Link = models.RunInformation.campaign.through
+    rows = Link.objects.filter(runinformation__key='dispatch.slip').values_list('runinformation__value', 'run__campaign__name')
+    return histogram(
+        'sisyphe_dispatch_slip_seconds',
+        "Delay between the scheduled time of a run and the end of its provisioning",
+        (((('campaign', campaign),), float(value)) for value, campaign in rows.iterator()),
+        buckets=SLIP_BUCKETS,
+    )
+
+
+def warm_pool_histograms():
+    Link = models.RunInformation.campaign.through
+    rows = Link.objects.filter(runinformation__key__in=['warmpool.hit', 'warmpool.miss']).values_list('runinformation__key', 'runinformation__value')
+    return histogram(
+        'sisyphe_warm_pool_claim_seconds',
+        "Time from the warm pool claim to a ready volume, by whether a pre-warmed volume was claimed",
+        (((('result', key.split('.')[1]),), float(value)) for key, value in rows.iterator()),
+    )
+
+
+def mirror_counters():
+    rows = models.RunInformation.objects.filter(key__in=['mirror.hit', 'mirror.bytes_saved']).values_list('key', 'value')
+    hits = misses = saved = 0
+    for key, value in rows.iterator():
+        if key == 'mirror.bytes_saved':
+            saved += int(value)
+        elif value == '1':
+            hits += 1
+        else:
+            misses += 1
+    return "\n".join([
+        "# HELP sisyphe_mirror_requests_total Clones of campaign sources served by the host git mirrors",
+        "# TYPE sisyphe_mirror_requests_total counter",
+        f'sisyphe_mirror_requests_total{{result="hit"}} {hits}',
+        f'sisyphe_mirror_requests_total{{result="miss"}} {misses}',
+        "# HELP sisyphe_mirror_bytes_saved_total Bytes the guests did not have to download",
+        "# TYPE sisyphe_mirror_bytes_saved_total counter",
+        f"sisyphe_mirror_bytes_saved_total {saved}",
+    ]) + "\n"
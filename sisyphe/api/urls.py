@@ -1,9 +1,24 @@
-from django.urls import path
+from django.urls import include, path
+from rest_framework import routers
 
 from . import views
 
+router = routers.DefaultRouter()
+router.register('campaigns', views.CampaignViewSet)
+router.register('runs', views.RunViewSet, basename='run')
+router.register('environment-variables', views.EnvironmentVariableViewSet)
+router.register('run-information', views.RunInformationViewSet)
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('campaign/<int:campaign_id>/', views.campaign_detail, name='campaign_detail'),
+    path('campaign/<int:campaign_id>/samples.json', views.campaign_samples, name='campaign_samples'),
     path('run/<int:run_id>/', views.run_detail, name='run_detail'),
+    path('run/<int:run_id>/samples.json', views.run_samples, name='run_samples'),
+    path('run/<int:run_id>/artifacts.tar', views.run_archive, {'format': 'tar'}, name='run_archive_tar'),
+    path('run/<int:run_id>/artifacts.zip', views.run_archive, {'format': 'zip'}, name='run_archive_zip'),
+    path('run/<int:run_id>/artifacts/manifest.json', views.run_manifest, name='run_manifest'),
+    path('run/<int:run_id>/artifacts/<path:path>', views.run_artifact, name='run_artifact'),
+    path('metrics', views.metrics, name='metrics'),
+    path('api/', include(router.urls)),
 ]
@@ -1,8 +1,23 @@
-from django.shortcuts import render
+import hashlib, os, stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render
 from django.template import loader
-from django.http import HttpResponse
-from .models import Campaign, Run
+from django.db.models import Sum
+from django.http import Http404, HttpResponse, StreamingHttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import permissions, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from .models import Campaign, Run, EnvironmentVariable, RunInformation
+from .serializers import CampaignSerializer, RunSerializer, EnvironmentVariableSerializer, RunInformationSerializer
+from . import admission, artifacts, caching, manifest, tracing, sampling
+
+RUNS_PER_PAGE = 50
 
+@caching.cached_page('index')
 def index(request):
     all_campaigns = Campaign.objects.order_by('name')[:5]
     template = loader.get_template('api/index.html')
@@ -11,16 +26,37 @@ def index(request):
     }
     return HttpResponse(template.render(context, request))
 
+def campaign_runs(campaign, before):
+    # Keyset pagination on (start, id), served by the (campaign, hidden, start) index.
+    # SQLite only uses the index for hidden when it is compared with IN, not for NOT hidden.
+    runs = campaign.run_set.filter(hidden__in=[False]).order_by('-start', '-id')
+    try:
+        before = int(before) if before else None
+    except ValueError:
+        # A mangled cursor shows the first page
+        before = None
+    if before:
+        cursor = Run.objects.filter(pk=before).values_list('start', flat=True).first()
+        if cursor is not None:
+            runs = runs.filter(start__lte=cursor).exclude(start=cursor, id__gte=before)
+    return runs
+
+@caching.cached_page('campaign', 'campaign_id')
 def campaign_detail(request, campaign_id):
     campaign = Campaign.objects.get(pk=campaign_id)
-    runs = campaign.run_set.all()
+    runs = list(campaign_runs(campaign, request.GET.get('before'))[:RUNS_PER_PAGE + 1])
     template = loader.get_template('api/campaign.html')
     context = {
         'campaign': campaign,
-        'runs': runs
+        'runs': runs[:RUNS_PER_PAGE],
+        'next_cursor': runs[RUNS_PER_PAGE - 1].pk if len(runs) > RUNS_PER_PAGE else None,
+        'queue': admission.queue_stats(campaign),
+        'dedup_saved': campaign.run_set.aggregate(saved=Sum('dedup_saved'))['saved'],
+        'fragment_timeout': settings.SISYPHE_PAGE_CACHE_TIMEOUT,
     }
     return HttpResponse(template.render(context, request))
 
+@caching.cached_page('run', 'run_id')
 def run_detail(request, run_id):
     run = Run.objects.get(pk=run_id)
     template = loader.get_template('api/run.html')
@@ -28,3 +64,195 @@ def run_detail(request, run_id):
         'run': run
     }
     return HttpResponse(template.render(context, request))
+
+
+def sample_points(request):
+    try:
+        return max(2, min(int(request.GET.get('points', 300)), 5000))
+    except ValueError:
+        return 300
+
+def run_samples(request, run_id):
+    run = get_object_or_404(Run, pk=run_id)
+    return JsonResponse({'run': run.uuid, 'series': sampling.series(run.pk, sample_points(request))})
+
+def campaign_samples(request, campaign_id):
+    campaign = get_object_or_404(Campaign, pk=campaign_id)
+    # Same pages as the campaign listing, with fewer points per run
+    runs = campaign_runs(campaign, request.GET.get('before'))
+    points = sample_points(request) if 'points' in request.GET else 60
+    return JsonResponse({
+        'campaign': campaign.name,
+        'runs': {run.uuid: sampling.series(run.pk, points) for run in runs[:RUNS_PER_PAGE]},
+    })
+
+def metrics(request):
+    return HttpResponse(tracing.phase_histograms() + tracing.slip_histograms() + tracing.warm_pool_histograms() + tracing.mirror_counters(), content_type='text/plain; version=0.0.4')
+
+
+def run_archive(request, run_id, format):
+    run = get_object_or_404(Run, pk=run_id)
+    root = artifacts.run_directory(run.uuid)
+    if not os.path.isdir(root):
+        raise Http404("No artifacts for this run")
+    entries = manifest.get(run)
+    filename = f"{run.uuid}.{format}"
+
+    if format == 'zip':
+        response = StreamingHttpResponse(artifacts.stream_zip(root, entries), content_type='application/zip')
+        response['Content-Disposition'] = attachment(filename)
+        return response
+
+    layout = artifacts.TarLayout(root, entries)
+    etag = quote_etag(artifacts.manifest_etag(entries))
+    return ranged_response(request, layout.size, layout.stream, etag, 'application/x-tar', filename)
+
+def run_manifest(request, run_id):
+    run = get_object_or_404(Run, pk=run_id)
+    root = artifacts.run_directory(run.uuid)
+    if not os.path.isdir(root):
+        raise Http404("No artifacts for this run")
+    entries = manifest.get(run)
+    layout = artifacts.TarLayout(root, entries)
+    # tar_offset lets a client fetch a single file out of artifacts.tar with a Range request
+    return JsonResponse({
+        'etag': artifacts.manifest_etag(entries),
+        'tar_size': layout.size,
+        'files': [
+            {'path': entry.path, 'size': entry.size, 'mtime': entry.mtime, 'link': entry.link, 'sha256': entry.digest, 'tar_offset': layout.offsets.get(entry.path)}
+            for entry in entries
+        ],
+    })
+
+def run_artifact(request, run_id, path):
+    run = get_object_or_404(Run, pk=run_id)
+    root = artifacts.run_directory(run.uuid)
+    relative = artifacts.resolve(root, path)
+    try:
+        fd = artifacts.open_file(root, relative) if relative is not None else None
+    except OSError:
+        fd = None
+    if fd is None:
+        raise Http404("No such artifact")
+    try:
+        info = os.fstat(fd)
+    finally:
+        os.close(fd)
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404("No such artifact")
+    if settings.SISYPHE_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the file itself, ranges included, and refuses symlinks too
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.SISYPHE_ACCEL_REDIRECT_PREFIX + quote(f"{run.uuid}/{relative}")
+        return response
+    size = info.st_size
+    etag = quote_etag(f"{info.st_mtime_ns:x}-{size:x}")
+
+    def stream(start=0, end=size):
+        return artifacts.read_file(root, relative, start, end - start)
+
+    return ranged_response(request, size, stream, etag, 'application/octet-stream', os.path.basename(relative))
+
+def ranged_response(request, size, stream, etag, content_type, filename):
+    byte_range = None
+    if request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = artifacts.parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+    if byte_range is None:
+        response = StreamingHttpResponse(stream(), content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(stream(start, end), content_type=content_type, status=206)
+        response['Content-Length'] = end - start
+        response['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = attachment(filename)
+    return response
+
+def attachment(filename):
+    # Guests name their files: an ASCII fallback for old clients, the exact name in filename* (RFC 5987)
+    fallback = ''.join(c if ' ' <= c < '\x7f' and c not in '"\\' else '_' for c in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+
+class StartCursorPagination(IdCursorPagination):
+    ordering = ('-start', '-id')
+
+class CampaignViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Campaign.objects.all()
+    serializer_class = CampaignSerializer
+    pagination_class = IdCursorPagination
+
+class RunViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = RunSerializer
+    pagination_class = StartCursorPagination
+
+    def campaign_filter(self):
+        campaign = self.request.query_params.get('campaign')
+        if not campaign:
+            return None
+        if not campaign.isdigit():
+            raise ValidationError({'campaign': "Expected a campaign id."})
+        return int(campaign)
+
+    def get_queryset(self):
+        runs = Run.objects.select_related('campaign')
+        campaign = self.campaign_filter()
+        if campaign is not None:
+            runs = runs.filter(campaign_id=campaign)
+        hidden = self.request.query_params.get('hidden')
+        if hidden in ('true', 'false'):
+            runs = runs.filter(hidden__in=[hidden == 'true'])
+        return runs
+
+    def list(self, request, *args, **kwargs):
+        # The page cache generations move with every change of a run (signals and caching.invalidate_runs):
+        # a poll costs a cache lookup instead of aggregating over the runs
+        campaign = self.campaign_filter()
+        if campaign is not None:
+            freshness = {'campaign': caching.generation('campaign', campaign)}
+        else:
+            freshness = {'runs': caching.generation('runs')}
+        return self.conditional(request, freshness, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        freshness = Run.objects.filter(pk=kwargs['pk']).values('start', 'end', 'hidden', 'file_count', 'total_bytes', 'provisioned', 'scheduled').first() or {}
+        return self.conditional(request, freshness, super().retrieve, *args, **kwargs)
+
+    def conditional(self, request, freshness, render, *args, **kwargs):
+        # Polling clients get a 304 as long as nothing they were served changed
+        changes = [date for date in (freshness.get('start'), freshness.get('end')) if date is not None]
+        last_modified = int(max(changes).timestamp()) if changes else None
+        digest = hashlib.sha1(f"{sorted(freshness.items())}:{request.get_full_path()}".encode()).hexdigest()
+        etag = quote_etag(digest)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render(request, *args, **kwargs)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+class EnvironmentVariableViewSet(viewsets.ReadOnlyModelViewSet):
+    # Values are secrets injected into the guests
+    queryset = EnvironmentVariable.objects.prefetch_related('campaign')
+    serializer_class = EnvironmentVariableSerializer
+    pagination_class = IdCursorPagination
+    permission_classes = [permissions.IsAdminUser]
+
+class RunInformationViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = RunInformation.objects.prefetch_related('campaign')
+    serializer_class = RunInformationSerializer
+    pagination_class = IdCursorPagination
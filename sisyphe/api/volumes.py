@@ -0,0 +1,82 @@
+import os, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import hypervisor, models
+from .hypervisor import POOL_PATH
+
+import libvirt
+
+VOLUME_PATTERN = re.compile(r'^volume_(.+)_nixos\.qcow2$')
+POLICIES = ('delete', 'wipe')
+
+# Full overwrites hammer the disk of the live experiments, never run several at once
+_wipe_lock = threading.Lock()
+
+
+def policy_for(campaign):
+    if campaign is not None and campaign.sensitive:
+        return 'wipe'
+    return settings.SISYPHE_VOLUME_RECLAIM
+
+
+def reclaim_volume(vol, policy):
+    started = time.monotonic()
+    if policy == 'wipe':
+        with _wipe_lock:
+            vol.wipe()
+    vol.delete()
+    print(f"Volume {vol.name()} reclaimed ({policy}) in {time.monotonic() - started:.3f}s")
+
+
+def find_orphans(connection, pool):
+    # One listing of the pool and of the domains, then two queries, whatever the number of volumes
+    pool.refresh(0)
+    volumes = {}
+    for name in pool.listVolumes():
+        match = VOLUME_PATTERN.match(name)
+        if match:
+            volumes[match.group(1)] = name
+    domains = {domain.name() for domain in connection.listAllDomains(0)}
+    active = set(models.Run.objects.filter(reclaimed__isnull=True, uuid__in=volumes).values_list('uuid', flat=True))
+    warm = set(models.WarmVolume.objects.filter(uuid__in=volumes).values_list('uuid', flat=True))
+
+    grace = time.time() - settings.SISYPHE_REAPER_GRACE
+    orphans = {}
+    for uuid, name in volumes.items():
+        if uuid in domains or uuid in active or uuid in warm:
+            continue
+        # Overlays being created are not registered anywhere yet
+        try:
+            if os.stat(os.path.join(POOL_PATH, name)).st_mtime > grace:
+                continue
+        except FileNotFoundError:
+            continue
+        orphans[uuid] = name
+    return orphans
+
+
+def delete_volumes(pool, names, sensitive=()):
+    # names maps the run uuids to their volume
+    def delete(uuid):
+        try:
+            policy = 'wipe' if uuid in sensitive else settings.SISYPHE_VOLUME_RECLAIM
+            reclaim_volume(pool.storageVolLookupByName(names[uuid]), policy)
+        except libvirt.libvirtError as e:
+            print(f"Failed to reclaim {names[uuid]}: {e}")
+        # Spreads the deletions so that the experiments keep most of the disk bandwidth
+        time.sleep(settings.SISYPHE_REAPER_PAUSE)
+
+    with ThreadPoolExecutor(max_workers=settings.SISYPHE_REAPER_WORKERS) as executor:
+        list(executor.map(delete, names))
+
+
+def reap(connection, dry_run=False):
+    pool = hypervisor.get_pool()
+    orphans = find_orphans(connection, pool)
+    if dry_run or not orphans:
+        return orphans
+    sensitive = set(models.Run.objects.filter(uuid__in=orphans, campaign__sensitive=True).values_list('uuid', flat=True))
+    delete_volumes(pool, orphans, sensitive)
+    return orphans
@@ -0,0 +1,19 @@
+from . import models, nodes
+
+
+def claim(backing_image_path):
+    # Deleting the row is the claim: only one worker can delete a given volume
+    while True:
+        volume = models.WarmVolume.objects.filter(hypervisor=nodes.local(), backing_image=backing_image_path).order_by('created').first()
+        if volume is None:
+            return None
+        deleted, _ = models.WarmVolume.objects.filter(pk=volume.pk).delete()
+        if deleted:
+            return volume.uuid
+
+
+def report(phases, hit, seconds):
+    # Stored with the phases of the run, /metrics turns them into a histogram per result
+    kind = "hit" if hit else "miss"
+    phases.note(f"warmpool.{kind}", f"{seconds:.6f}")
+    print(f"Warm pool {kind}: volume ready in {seconds:.3f}s")
@@ -75,10 +75,15 @@ WSGI_APPLICATION = 'sisyphe.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# SQLite by default, a database shared by every node of a deployment otherwise
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3'),
         'NAME': os.environ.get('DB_NAME'),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
     }
 }
 
@@ -128,9 +133,135 @@ CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'refill-warm-pool': {
+        'task': 'api.tasks.onEveryHypervisor',
+        'args': ('api.tasks.refillWarmPool',),
+        'schedule': 300.0,
+    },
+    'admit-runs': {
+        'task': 'api.tasks.admitRuns',
+        'schedule': 60.0,
+    },
+    'reconcile-runs': {
+        'task': 'api.tasks.onEveryHypervisor',
+        'args': ('api.tasks.reconcileRuns',),
+        'schedule': 600.0,
+    },
+    'downsample-samples': {
+        'task': 'api.tasks.downsampleSamples',
+        'schedule': 3600.0,
+    },
+    'collect-backing-images': {
+        'task': 'api.tasks.onEveryHypervisor',
+        'args': ('api.tasks.collectBackingImages',),
+        'schedule': 3600.0,
+    },
+    'reap-volumes': {
+        'task': 'api.tasks.onEveryHypervisor',
+        'args': ('api.tasks.reapVolumes',),
+        'schedule': 900.0,
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD='django.db.models.AutoField'
 
 SISYPHE_ISO_PATH = os.environ.get('SISYPHE_ISO_PATH'),
+
+# Number of overlays kept ready on top of the current backing image
+SISYPHE_WARM_POOL_SIZE = int(os.environ.get('SISYPHE_WARM_POOL_SIZE', '0'))
+
+# How secrets reach the guest: guestfish, shared or configdisk
+SISYPHE_INJECTION_BACKEND = os.environ.get('SISYPHE_INJECTION_BACKEND', 'guestfish')
+
+# Backoff used when the worker (re)connects to libvirt, in seconds
+SISYPHE_LIBVIRT_RECONNECT_DELAY = float(os.environ.get('SISYPHE_LIBVIRT_RECONNECT_DELAY', '1'))
+SISYPHE_LIBVIRT_RECONNECT_ATTEMPTS = int(os.environ.get('SISYPHE_LIBVIRT_RECONNECT_ATTEMPTS', '5'))
+
+# Host capacity handed out to runs by the admission queue (memory in MiB)
+SISYPHE_HOST_RESERVED_MEMORY = int(os.environ.get('SISYPHE_HOST_RESERVED_MEMORY', '1024'))
+SISYPHE_MEMORY_OVERCOMMIT = float(os.environ.get('SISYPHE_MEMORY_OVERCOMMIT', '1.0'))
+SISYPHE_CPU_OVERCOMMIT = float(os.environ.get('SISYPHE_CPU_OVERCOMMIT', '1.0'))
+
+# SSH ports forwarded to the domains, leased for the run duration plus a grace period (minutes)
+SISYPHE_SSH_PORT_RANGE = (
+    int(os.environ.get('SISYPHE_SSH_PORT_MIN', '10000')),
+    int(os.environ.get('SISYPHE_SSH_PORT_MAX', '40000')),
+)
+SISYPHE_PORT_LEASE_GRACE = int(os.environ.get('SISYPHE_PORT_LEASE_GRACE', '30'))
+
+# Seconds a domain gets to shut down cleanly before being destroyed
+SISYPHE_SHUTDOWN_DEADLINE = int(os.environ.get('SISYPHE_SHUTDOWN_DEADLINE', '600'))
+
+# SSH keypair of each run: rsa or ed25519, optionally pre-generated by a bounded pool
+SISYPHE_SSH_KEY_TYPE = os.environ.get('SISYPHE_SSH_KEY_TYPE', 'rsa')
+SISYPHE_SSH_KEY_POOL_SIZE = int(os.environ.get('SISYPHE_SSH_KEY_POOL_SIZE', '0'))
+
+# Where the run directories live, and the internal nginx location serving them (optional)
+SISYPHE_ARTIFACTS_ROOT = os.environ.get('SISYPHE_ARTIFACTS_ROOT', '/home/sisyphe')
+SISYPHE_ACCEL_REDIRECT_PREFIX = os.environ.get('SISYPHE_ACCEL_REDIRECT_PREFIX')
+
+# Content-addressed store shared by the run directories (hardlink or reflink)
+SISYPHE_BLOB_ROOT = os.environ.get('SISYPHE_BLOB_ROOT', '/home/sisyphe/.blobs')
+SISYPHE_DEDUP_MODE = os.environ.get('SISYPHE_DEDUP_MODE', 'hardlink')
+SISYPHE_DEDUP_MIN_SIZE = int(os.environ.get('SISYPHE_DEDUP_MIN_SIZE', '4096'))
+
+# Stored manifest of each finished run, and the threads listing and hashing its directory
+SISYPHE_MANIFEST_ROOT = os.environ.get('SISYPHE_MANIFEST_ROOT', '/home/sisyphe/.manifests')
+SISYPHE_MANIFEST_WORKERS = int(os.environ.get('SISYPHE_MANIFEST_WORKERS', '4'))
+
+# Volume reclamation: delete or wipe; sensitive campaigns always wipe
+SISYPHE_VOLUME_RECLAIM = os.environ.get('SISYPHE_VOLUME_RECLAIM', 'delete')
+# Orphan volume reaper: parallel deletions, pause after each one, minimum age in seconds
+SISYPHE_REAPER_WORKERS = int(os.environ.get('SISYPHE_REAPER_WORKERS', '2'))
+SISYPHE_REAPER_PAUSE = float(os.environ.get('SISYPHE_REAPER_PAUSE', '1'))
+SISYPHE_REAPER_GRACE = int(os.environ.get('SISYPHE_REAPER_GRACE', '600'))
+
+# Seconds a run may stay without a domain before the reconciler gives it up
+SISYPHE_RECONCILE_GRACE = int(os.environ.get('SISYPHE_RECONCILE_GRACE', '1800'))
+
+# Raw resource samples are kept that many seconds, then only one per window of WIDTH seconds
+SISYPHE_SAMPLES_RAW_RETENTION = int(os.environ.get('SISYPHE_SAMPLES_RAW_RETENTION', '86400'))
+SISYPHE_SAMPLES_DOWNSAMPLE_WIDTH = int(os.environ.get('SISYPHE_SAMPLES_DOWNSAMPLE_WIDTH', '60'))
+
+# Host CPUs handed out whole cores at a time to pinned runs (e.g. "4-15"), everything else runs on the others
+SISYPHE_PINNABLE_CPUS = os.environ.get('SISYPHE_PINNABLE_CPUS', '')
+
+# Bare mirrors of the campaign sources, cloned locally into each run (empty to disable)
+SISYPHE_MIRROR_ROOT = os.environ.get('SISYPHE_MIRROR_ROOT', '/home/sisyphe/.mirrors')
+SISYPHE_MIRROR_TIMEOUT = int(os.environ.get('SISYPHE_MIRROR_TIMEOUT', '600'))
+
+# Local copy of the backing image next to the overlays: qemu-img preallocation mode, compressed clusters
+SISYPHE_BACKING_IMAGE_PREALLOCATION = os.environ.get('SISYPHE_BACKING_IMAGE_PREALLOCATION', 'metadata')
+SISYPHE_BACKING_IMAGE_COMPRESS = os.environ.get('SISYPHE_BACKING_IMAGE_COMPRESS', 'False') == 'True'
+
+# Scheduled runs start within this many seconds of their slot, and at most that many provision at once
+SISYPHE_DISPATCH_WINDOW = int(os.environ.get('SISYPHE_DISPATCH_WINDOW', '300'))
+SISYPHE_PROVISIONING_CONCURRENCY = int(os.environ.get('SISYPHE_PROVISIONING_CONCURRENCY', '2'))
+
+# Name of this node, which also names its Celery queue, and the libvirt URI of its hypervisor (local one when empty)
+SISYPHE_HYPERVISOR_NAME = os.environ.get('SISYPHE_HYPERVISOR_NAME', os.uname().nodename)
+SISYPHE_LIBVIRT_URI = os.environ.get('SISYPHE_LIBVIRT_URI') or None
+# Seconds between two heartbeats of a node, and without one before it stops receiving runs
+SISYPHE_HEARTBEAT_INTERVAL = int(os.environ.get('SISYPHE_HEARTBEAT_INTERVAL', '15'))
+SISYPHE_HEARTBEAT_TIMEOUT = int(os.environ.get('SISYPHE_HEARTBEAT_TIMEOUT', '60'))
+
+# libvirt domain type, 'test' to provision against the test:///default driver
+SISYPHE_DOMAIN_TYPE = os.environ.get('SISYPHE_DOMAIN_TYPE', 'kvm')
+
+# Rendered pages, in the database shared by the web server and the workers of every node
+# which invalidate them (manage.py createcachetable)
+SISYPHE_PAGE_CACHE_TIMEOUT = int(os.environ.get('SISYPHE_PAGE_CACHE_TIMEOUT', '600'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': os.environ.get('SISYPHE_CACHE_TABLE', 'sisyphe_cache'),
+        'TIMEOUT': SISYPHE_PAGE_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('SISYPHE_CACHE_MAX_ENTRIES', '10000'))},
+    }
+}
+# Cache-Control of the HTML pages, for nginx and the browsers
+SISYPHE_PAGE_MAX_AGE = int(os.environ.get('SISYPHE_PAGE_MAX_AGE', '30'))
+SISYPHE_PAGE_STALE_WHILE_REVALIDATE = int(os.environ.get('SISYPHE_PAGE_STALE_WHILE_REVALIDATE', '300'))